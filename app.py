@@ -1,32 +1,93 @@
+import os
 import streamlit as st
+from backends import get_router
+from config import ADMIN_USERS, DEFAULT_FOLDER, MODEL_NAME, SHOW_REASONING
+from metrics import registry
 from aux_functions import (
     init_session_state,
     deepseek_response,
     deepseek_response_streaming,
     login_user,
+    logout_user,
     create_folder,
+    rename_folder,
+    create_conversation,
+    rename_conversation,
     get_user_folders,
+    get_conversation_turns,
+    get_visible_turn_count,
+    load_older_turns,
+    render_turn,
+    search_conversations,
+    open_search_hit,
+    load_user_tree,
     send_message,
     load_conversations,
-    update_conversations
+    setup_metrics,
+    get_available_models,
+    get_model_settings,
+    set_folder_model,
+    set_conversation_model,
+    refresh_user_tree,
+    move_conversations,
+    rename_conversations,
+    delete_conversations,
+    delete_folder,
+    start_export,
+    start_import,
+    get_archive_jobs,
+    read_archive
 )
 
-# Inicializar variables de sesión
-init_session_state()
 
-# Cargar conversaciones desde JSON comprimido
-load_conversations() 
+def show_archive_jobs():
+    """
+    Muestra el progreso de las exportaciones e importaciones del usuario. Mientras
+    haya alguna en curso se vuelve a pintar cada segundo (ver st.fragment más abajo).
+    """
+    seen = st.session_state.setdefault("finished_archive_jobs", set())
+    newly_finished = False
+    for job in get_archive_jobs():
+        label = f"{'⬇ Exportación' if job.kind == 'export' else '⬆ Importación'}: {job.description}"
+        if not job.finished:
+            st.progress(job.progress, text=f"{label} ({job.progress:.0%})")
+            continue
+        if job.id not in seen:
+            seen.add(job.id)
+            newly_finished = True
+        if job.status == "done":
+            st.success(f"{label}: {job.result}")
+            if job.kind == "export" and os.path.exists(job.path):
+                st.caption(f"Archivo en el servidor: {job.path} ({os.path.getsize(job.path) / 2**20:.1f} MiB)")
+                # Streamlit sirve las descargas desde memoria: el archivo solo se lee cuando
+                # el usuario pide descargarlo, y solo el de un trabajo a la vez
+                if (st.session_state.get("download_job") == job.id
+                        or st.button("Preparar descarga", key=f"prepare_{job.id}")):
+                    st.session_state.download_job = job.id
+                    st.download_button(
+                        "Descargar", data=read_archive(job.path),
+                        file_name=f"conversaciones-{job.id}.jsonl.gz", mime="application/gzip",
+                        key=f"download_{job.id}",
+                    )
+        else:
+            st.error(f"{label}: {job.result}")
+    # Al terminar un trabajo, recargar la página entera (con las carpetas importadas)
+    if newly_finished:
+        refresh_user_tree(st.session_state.username)
+        st.rerun()
+
+# Inicializar las métricas del proceso (una sola vez) y las variables de sesión
+setup_metrics()
+init_session_state()
 
-# Si se ha marcado `should_rerun`, hacer `st.rerun()` fuera de los callbacks
-if "should_rerun" in st.session_state and st.session_state.should_rerun:
-    st.session_state.should_rerun = False  # 🔹 Restablecemos el estado
-    st.rerun()  # 🔹 Ahora el rerun se ejecuta en un lugar válido
+# Migrar conversaciones del antiguo JSON comprimido a la base de datos, si las hubiera
+load_conversations()
 
 # Asegurar que las claves esenciales existen en session_state
 if "username" not in st.session_state:
     st.session_state.username = None
-if "conversations" not in st.session_state:
-    st.session_state.conversations = {}
+if "folders" not in st.session_state:
+    st.session_state.folders = {}
 if "current_folder" not in st.session_state:
     st.session_state.current_folder = "General"
 if "current_conversation" not in st.session_state:
@@ -48,25 +109,12 @@ if not st.session_state.logged_in:
 else:
     st.sidebar.title("Gestión de Carpetas")
 
-    # Crear estructura si el usuario aún no tiene conversaciones
-    if st.session_state.username not in st.session_state.conversations:
-        st.session_state.conversations[st.session_state.username] = {}
-
-    user_conversations = st.session_state.conversations[st.session_state.username]
-
-    # Asegurar que siempre exista la carpeta "General"
-    if "General" not in user_conversations:
-        user_conversations["General"] = {}
-
-    # 🔥 **CORRECCIÓN: Convertimos listas en diccionarios**
-    for folder in list(user_conversations.keys()):
-        if isinstance(user_conversations[folder], list):
-            user_conversations[folder] = {"Conversación 1": user_conversations[folder]}
-        if "Conversación 1" not in user_conversations[folder]:  # Siempre debe haber al menos 1 conversación
-            user_conversations[folder]["Conversación 1"] = []
+    # Cargar la estructura de carpetas si la sesión aún no la tiene
+    if not st.session_state.folders:
+        load_user_tree(st.session_state.username)
 
     # Obtener carpetas del usuario
-    user_folders = list(user_conversations.keys())
+    user_folders = get_user_folders(st.session_state.username)
     
     # Construir lista de opciones con carpetas arriba y opciones abajo
     folder_options = user_folders + ["    ⬇⬇ Gestionar ⬇⬇", "Nueva Carpeta", "Renombrar Carpeta"]
@@ -82,12 +130,9 @@ else:
     if selected_folder == "Nueva Carpeta":
         new_folder = st.sidebar.text_input("Nombre de la nueva carpeta")
         if st.sidebar.button("Crear carpeta") and new_folder.strip():
-            if new_folder not in user_conversations:
-                user_conversations[new_folder] = {"Conversación 1": []}
-                st.session_state.current_folder = new_folder
+            if create_folder(st.session_state.username, new_folder):
                 st.session_state.current_conversation = "Conversación 1"
                 st.sidebar.success(f"Carpeta '{new_folder}' creada")
-                update_conversations()  # Guardar los cambios
                 st.rerun()
             else:
                 st.sidebar.error("La carpeta ya existe")
@@ -99,20 +144,17 @@ else:
 
         if st.sidebar.button("Guardar nuevo nombre"):
             if new_folder_name.strip() and new_folder_name != folder_to_rename:
-                if new_folder_name not in user_conversations:
-                    # Mover contenido de la carpeta antigua a la nueva
-                    user_conversations[new_folder_name] = user_conversations.pop(folder_to_rename)
-
+                # Mover contenido de la carpeta antigua a la nueva
+                if rename_folder(st.session_state.username, folder_to_rename, new_folder_name):
                     # Si la carpeta renombrada era "General", crear una nueva carpeta "General" vacía
                     if folder_to_rename == "General":
-                        user_conversations["General"] = {"Conversación 1": []}  # Mantener estructura de inicio
+                        create_folder(st.session_state.username, "General")  # Mantener estructura de inicio
                         st.session_state.general_renamed = True  # Guardar aviso en session_state
 
                     # Actualizar la carpeta actual en la sesión
                     st.session_state.current_folder = new_folder_name
                     st.sidebar.success(f"Carpeta renombrada a '{new_folder_name}'")
 
-                    update_conversations()  # Guarda los cambios
                     st.rerun()
                 else:
                     st.sidebar.error("Ese nombre ya existe, elige otro")
@@ -131,8 +173,7 @@ else:
 
 
     # Obtener la lista de conversaciones en la carpeta actual
-    current_folder_conversations = user_conversations[st.session_state.current_folder]
-    conversation_list = list(current_folder_conversations.keys())
+    conversation_list = list(st.session_state.folders[st.session_state.current_folder])
 
     # Construir la lista de opciones con conversaciones arriba y opciones de gestión abajo
     conversation_options = conversation_list + ["    ⬇⬇ Gestionar ⬇⬇", "Nueva Conversación", "Renombrar Conversación"]
@@ -148,11 +189,9 @@ else:
     if selected_conversation == "Nueva Conversación":
         new_conversation_name = st.sidebar.text_input("Nombre de la nueva conversación")
         if st.sidebar.button("Crear Conversación") and new_conversation_name.strip():
-            if new_conversation_name not in current_folder_conversations:
-                current_folder_conversations[new_conversation_name] = []
+            if create_conversation(st.session_state.username, st.session_state.current_folder, new_conversation_name):
                 st.session_state.current_conversation = new_conversation_name
                 st.sidebar.success(f"Conversación '{new_conversation_name}' creada")
-                update_conversations()  # Guarda los cambios
                 st.rerun()
             else:
                 st.sidebar.error("Ese nombre ya existe, elige otro")
@@ -163,15 +202,14 @@ else:
 
         if st.sidebar.button("Renombrar Conversación"):
             if new_conversation_name.strip() and new_conversation_name != conversation_to_rename:
-                if new_conversation_name not in current_folder_conversations:
-                    # Mover el contenido de la conversación antigua a la nueva
-                    current_folder_conversations[new_conversation_name] = current_folder_conversations.pop(conversation_to_rename)
+                # Mover el contenido de la conversación antigua a la nueva
+                if rename_conversation(st.session_state.username, st.session_state.current_folder,
+                                       conversation_to_rename, new_conversation_name):
 
                     # Actualizar la conversación actual en la sesión
                     st.session_state.current_conversation = new_conversation_name
                     st.sidebar.success(f"Conversación renombrada a '{new_conversation_name}'")
 
-                    update_conversations()  # Guarda los cambios
                     st.rerun()
                 else:
                     st.sidebar.error("Ese nombre ya existe, elige otro")
@@ -183,13 +221,54 @@ else:
         st.session_state.current_conversation = selected_conversation
 
 
+    # Modelo de la carpeta y de la conversación actuales
+    st.sidebar.markdown("---")
+    folder_model, conversation_model = get_model_settings(
+        st.session_state.username, st.session_state.current_folder, st.session_state.current_conversation
+    )
+    model_options = [None] + get_available_models()
+    for model in (folder_model, conversation_model):
+        if model not in model_options:
+            model_options.append(model)  # Elegido antes pero ya no configurado
+
+    selected_folder_model = st.sidebar.selectbox(
+        "🤖 Modelo de la carpeta",
+        model_options,
+        index=model_options.index(folder_model),
+        format_func=lambda model: model or f"Por defecto ({MODEL_NAME})",
+    )
+    if selected_folder_model != folder_model:
+        set_folder_model(st.session_state.username, st.session_state.current_folder, selected_folder_model)
+        folder_model = selected_folder_model
+
+    selected_conversation_model = st.sidebar.selectbox(
+        "🤖 Modelo de la conversación",
+        model_options,
+        index=model_options.index(conversation_model),
+        format_func=lambda model: model or f"El de la carpeta ({folder_model or MODEL_NAME})",
+    )
+    if selected_conversation_model != conversation_model:
+        set_conversation_model(st.session_state.username, st.session_state.current_folder,
+                               st.session_state.current_conversation, selected_conversation_model)
+
+    # Búsqueda en todas las conversaciones del usuario
+    st.sidebar.markdown("---")
+    search_query = st.sidebar.text_input("🔎 Buscar en mis conversaciones")
+    if search_query.strip():
+        hits = search_conversations(search_query)
+        if not hits:
+            st.sidebar.caption("Sin resultados")
+        for i, hit in enumerate(hits):
+            st.sidebar.markdown(f"📁 {hit['folder']} | 💬 {hit['conversation']} (#{hit['position'] + 1})\n\n{hit['snippet']}")
+            st.sidebar.button(
+                "Abrir", key=f"search_hit_{i}",
+                on_click=open_search_hit, args=(hit["folder"], hit["conversation"], hit["position"]),
+            )
+
     # Botón de cerrar sesión
     st.sidebar.markdown("---")
     if st.sidebar.button("Cerrar sesión"):
-        st.session_state.logged_in = False
-        st.session_state.username = None
-        st.session_state.current_folder = "General"
-        st.session_state.current_conversation = "Conversación 1"
+        logout_user()
         st.rerun()
 
 # Título principal de la aplicación
@@ -199,20 +278,88 @@ if st.session_state.logged_in:
     st.subheader(f"📁 Carpeta: {st.session_state.current_folder} | 💬 {st.session_state.current_conversation}")
 
     # Obtener mensajes de la conversación seleccionada
-    conversation = st.session_state.conversations[st.session_state.username][st.session_state.current_folder].get(
-        st.session_state.current_conversation, []
-    )
+    conversation = get_conversation_turns(st.session_state.current_folder, st.session_state.current_conversation)
 
-    # Mostrar historial de conversación
+    # Mostrar historial de conversación: solo los últimos turnos, el resto bajo demanda
     if conversation:
-        for entry in conversation:
-            st.markdown(f"**Tú:** {entry['user']}")
-            st.markdown(f"**Chatbot:** {entry['bot']}")
-            st.markdown("---")
+        visible_count = get_visible_turn_count(st.session_state.current_folder, st.session_state.current_conversation)
+        first_visible = max(0, len(conversation) - visible_count)
+        if first_visible > 0:
+            st.button(
+                f"⬆ Cargar mensajes anteriores ({first_visible} más)",
+                on_click=load_older_turns,
+                args=(st.session_state.current_folder, st.session_state.current_conversation),
+            )
+        for entry in conversation[first_visible:]:
+            st.markdown(render_turn(entry["user"], entry["bot"]))
     else:
         st.info("No hay mensajes en esta conversación aún.")
 
+    # Mostrar el razonamiento de la última respuesta de esta conversación
+    last_reasoning = st.session_state.get("last_reasoning")
+    current = (st.session_state.username, st.session_state.current_folder, st.session_state.current_conversation)
+    if SHOW_REASONING and last_reasoning and last_reasoning[3] and last_reasoning[:3] == current:
+        with st.expander("🧠 Razonamiento de la última respuesta"):
+            st.text(last_reasoning[3])
+
     # Entrada de mensaje del usuario con `on_change`
     st.text_input("Envía un mensaje", key="user_input", on_change=send_message)
+
+    # Operaciones sobre varias conversaciones a la vez, exportación e importación
+    with st.expander("🗂 Operaciones en bloque, exportar e importar"):
+        username = st.session_state.username
+        folder = st.session_state.current_folder
+        selected = st.multiselect(f"Conversaciones de '{folder}'", st.session_state.folders[folder])
+        action = st.radio("Acción", ["Mover a otra carpeta", "Renombrar", "Eliminar"], horizontal=True)
+        if action == "Mover a otra carpeta":
+            target_folder = st.text_input("Carpeta de destino (se crea si no existe)")
+            if st.button("Mover", disabled=not selected) and target_folder.strip():
+                moved = move_conversations(username, folder, selected, target_folder.strip())
+                st.session_state.bulk_message = f"{len(moved)} de {len(selected)} conversaciones movidas a '{target_folder.strip()}'"
+                st.rerun()
+        elif action == "Renombrar":
+            old_text = st.text_input("Texto a reemplazar en el nombre")
+            new_text = st.text_input("Reemplazar por")
+            if st.button("Renombrar", disabled=not selected) and old_text:
+                renamed = rename_conversations(username, folder, selected, old_text, new_text)
+                st.session_state.bulk_message = f"{len(renamed)} de {len(selected)} conversaciones renombradas"
+                st.rerun()
+        else:
+            confirm = st.checkbox("Borrar también todos sus mensajes (no se puede deshacer)")
+            if st.button("Eliminar", disabled=not (selected and confirm)):
+                deleted = delete_conversations(username, folder, selected)
+                st.session_state.bulk_message = f"{deleted} conversaciones eliminadas"
+                st.rerun()
+        if folder != DEFAULT_FOLDER:
+            confirm_folder = st.checkbox(f"Eliminar la carpeta '{folder}' con todas sus conversaciones")
+            if st.button("Eliminar carpeta", disabled=not confirm_folder):
+                delete_folder(username, folder)
+                st.session_state.bulk_message = f"Carpeta '{folder}' eliminada"
+                st.rerun()
+        if st.session_state.get("bulk_message"):
+            st.info(st.session_state.pop("bulk_message"))
+
+        st.markdown("---")
+        export_folders = st.multiselect("Carpetas a exportar (ninguna = todas)", get_user_folders(username))
+        if st.button("Exportar"):
+            start_export(export_folders)
+        if username in ADMIN_USERS and st.button("Copia de seguridad de todos los usuarios"):
+            start_export(all_users=True)
+
+        uploaded = st.file_uploader("Importar conversaciones (.jsonl.gz)", type=["gz"])
+        restore_users = username in ADMIN_USERS and st.checkbox("Restaurar para los usuarios del archivo")
+        if uploaded is not None and st.button("Importar"):
+            start_import(uploaded, restore_users)
+
+        # Progreso de los trabajos en segundo plano, sin bloquear el resto de la página
+        active = any(not job.finished for job in get_archive_jobs())
+        st.fragment(show_archive_jobs, run_every=1 if active else None)()
+
+    # Panel de métricas del servidor, solo para administradores
+    if st.session_state.username in ADMIN_USERS:
+        with st.expander("📊 Métricas del servidor"):
+            st.dataframe(registry.summary(), hide_index=True)
+            st.dataframe(get_router().stats(), hide_index=True)
+            st.code(registry.render_prometheus(), language="text")
 else:
     st.warning("Por favor, inicia sesión para continuar.")
@@ -0,0 +1,207 @@
+"""
+Exportación e importación de conversaciones en segundo plano.
+
+Los archivos son JSONL comprimidos con gzip, con un turno por línea:
+
+    {"username": ..., "folder": ..., "conversation": ..., "user": ..., "bot": ..., "created": ...}
+
+Una conversación sin mensajes se exporta como una línea sin "user" ni "bot". Se lee
+y se escribe conversación a conversación (al importar, en bloques de ARCHIVE_CHUNK_TURNS
+turnos por transacción), así que la memoria usada no depende del tamaño del archivo.
+Los trabajos se ejecutan de uno en uno en un hilo aparte y publican su progreso.
+"""
+import gzip
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import ARCHIVE_DIR, ARCHIVE_CHUNK_TURNS
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Trabajos terminados que se recuerdan por usuario
+MAX_FINISHED_JOBS = 10
+
+
+class ArchiveJob:
+    """
+    Exportación o importación en curso, con su progreso (done / total).
+    """
+
+    def __init__(self, kind, owner, path, description):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind  # "export" o "import"
+        self.owner = owner
+        self.path = path
+        self.description = description
+        self.status = PENDING
+        self.done = 0
+        self.total = 0
+        self.result = ""
+        self.created = time.time()
+
+    @property
+    def progress(self):
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+
+def export_conversations(store, path, username=None, folders=None, job=None):
+    """
+    Escribe en `path` las conversaciones del usuario (de todos si `username` es None),
+    opcionalmente solo las de `folders`. Retorna (conversaciones, turnos) exportados.
+    """
+    conversations = store.list_conversation_ids(username, folders)
+    if job is not None:
+        job.total = len(conversations)
+    exported = 0
+    tmp_path = path + ".part"
+    try:
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for i, (conversation_id, owner, folder, conversation) in enumerate(conversations):
+                header = {"username": owner, "folder": folder, "conversation": conversation}
+                turns = store.conversation_turns(conversation_id)
+                if not turns:
+                    f.write(json.dumps(header, ensure_ascii=False) + "\n")
+                for user, bot, created in turns:
+                    line = dict(header, user=user, bot=bot, created=created)
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                exported += len(turns)
+                if job is not None:
+                    job.done = i + 1
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    # El archivo solo aparece con su nombre final cuando está completo
+    os.replace(tmp_path, path)
+    return len(conversations), exported
+
+
+def import_conversations(store, path, username=None, job=None):
+    """
+    Importa un archivo generado por export_conversations. Con `username`, todas las
+    conversaciones se importan para ese usuario; sin él, para el usuario de cada línea.
+    Cada conversación se crea nueva (ver ConversationStore.import_conversation).
+    Retorna (conversaciones, turnos) importados.
+    """
+    conversations = imported = 0
+    key = None              # (usuario, carpeta, conversación) en curso
+    conversation_id = None  # Se conoce tras guardar el primer bloque
+    chunk = []
+
+    def flush():
+        nonlocal conversation_id, imported
+        if key is not None and (chunk or conversation_id is None):
+            conversation_id = store.import_conversation(*key, chunk, conversation_id)
+            imported += len(chunk)
+            chunk.clear()
+
+    with open(path, "rb") as raw:
+        if job is not None:
+            job.total = os.path.getsize(path)
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                line_key = (username or record["username"], record["folder"], record["conversation"])
+                if line_key != key:
+                    flush()
+                    key, conversation_id = line_key, None
+                    conversations += 1
+                if "user" in record:
+                    chunk.append((record["user"], record["bot"], record.get("created") or time.time()))
+                    if len(chunk) >= ARCHIVE_CHUNK_TURNS:
+                        flush()
+                if job is not None:
+                    job.done = raw.tell()
+            flush()
+    return conversations, imported
+
+
+class ArchiveWorker:
+    """
+    Ejecuta exportaciones e importaciones en un hilo en segundo plano.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self._jobs = OrderedDict()  # id -> ArchiveJob
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+
+    def new_path(self, suffix):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}{suffix}")
+
+    def export(self, store, owner, username=None, folders=None, description=""):
+        """
+        Programa la exportación. Retorna el ArchiveJob; el archivo queda en `job.path`.
+        """
+        job = self._add(ArchiveJob("export", owner, self.new_path(".jsonl.gz"), description))
+        self._executor.submit(self._run, job, export_conversations, store, job.path, username, folders)
+        return job
+
+    def import_file(self, store, owner, path, username=None, description=""):
+        """
+        Programa la importación de `path`, que se borra al terminar. Retorna el ArchiveJob.
+        """
+        job = self._add(ArchiveJob("import", owner, path, description))
+        self._executor.submit(self._run, job, import_conversations, store, path, username)
+        return job
+
+    def jobs_for(self, owner):
+        """
+        Retorna los trabajos del usuario, del más reciente al más antiguo.
+        """
+        with self._lock:
+            return [job for job in reversed(self._jobs.values()) if job.owner == owner]
+
+    def _add(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.owner == job.owner and j.finished]
+            for old in finished[:-MAX_FINISHED_JOBS]:
+                del self._jobs[old.id]
+                if old.kind == "export" and os.path.exists(old.path):
+                    os.remove(old.path)
+        return job
+
+    def _run(self, job, operation, *args):
+        job.status = RUNNING
+        try:
+            conversations, turns = operation(*args, job=job)
+            job.result = f"{conversations} conversaciones, {turns} mensajes"
+            job.status = DONE
+        except Exception as e:  # El error se muestra al usuario en lugar de perderse en el hilo
+            job.result = f"Error: {e}"
+            job.status = FAILED
+        finally:
+            if job.kind == "import" and os.path.exists(job.path):
+                os.remove(job.path)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_archive_worker():
+    """
+    Retorna el trabajador de archivos compartido por todas las sesiones.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = ArchiveWorker()
+        return _worker
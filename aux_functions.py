@@ -1,9 +1,90 @@
 import streamlit as st
 import requests
 import json
+import logging
+import shutil
 import sys
-import re
-import time
+from contextlib import contextmanager
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from archive import get_archive_worker
+from backends import get_router
+from config import (
+    ADMIN_USERS,
+    DB_PATH,
+    DEFAULT_FOLDER,
+    DEFAULT_CONVERSATION,
+    HISTORY_PAGE_SIZE,
+    MODEL_NAME,
+    MODEL_OPTIONS,
+    METRICS_LOG,
+    METRICS_PORT,
+    OLLAMA_KEEP_ALIVE,
+    RAG_ENABLED,
+    RESPONSE_CACHE_ENABLED,
+    SYSTEM_MESSAGE,
+    SHOW_REASONING,
+    SUMMARY_ENABLED,
+)
+from context import build_context
+from conversation_cache import get_conversation_cache
+from metrics import ModelCallMetrics, registry, start_metrics_server
+from retrieval import get_retriever
+from response_cache import get_response_cache, is_cacheable, make_key
+from scheduler import QueueFull, RequestCancelled, get_scheduler
+from storage import ConversationStore
+from streaming import StreamRenderer, ThinkParser, split_think
+from summary import get_summarizer
+
+BUSY_MESSAGE = "El servidor está ocupado en este momento. Inténtalo de nuevo en unos minutos."
+
+@st.cache_resource
+def get_store():
+    """
+    Retorna el almacén de conversaciones compartido por todas las sesiones.
+    """
+    return ConversationStore(DB_PATH)
+
+@st.cache_resource
+def setup_metrics():
+    """
+    Registra los gauges del planificador, de los servidores y de las cachés,
+    arranca las comprobaciones de los servidores y, si está configurado, el servidor de
+    métricas y el log por llamada. Una vez por proceso.
+    """
+    registry.register_gauge(
+        "chatbot_requests_in_flight", "Llamadas al modelo en curso",
+        lambda: {(("model", model),): active for model, (active, _) in get_scheduler().stats().items()},
+    )
+    registry.register_gauge(
+        "chatbot_requests_queued", "Llamadas al modelo esperando turno",
+        lambda: {(("model", model),): queued for model, (_, queued) in get_scheduler().stats().items()},
+    )
+    registry.register_gauge(
+        "chatbot_backend_up", "Estado de cada servidor de Ollama (1 = sano)",
+        lambda: {(("backend", backend.name),): int(backend.healthy) for backend in get_router().backends},
+    )
+    registry.register_gauge(
+        "chatbot_conversation_cache", "Aciertos, fallos y tamaño de la caché de conversaciones",
+        lambda: {(("stat", name),): value for name, value in get_conversation_cache().stats().items()},
+    )
+    if RESPONSE_CACHE_ENABLED:
+        registry.register_gauge(
+            "chatbot_response_cache", "Aciertos, fallos y tamaño de la caché de respuestas",
+            lambda: {(("stat", name),): value for name, value in get_response_cache().stats().items()},
+        )
+    if METRICS_LOG:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        metrics_logger = logging.getLogger("chatbot.metrics")
+        metrics_logger.addHandler(handler)
+        metrics_logger.setLevel(logging.INFO)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    # Comprobar los servidores y cargar los modelos por adelantado, en segundo plano
+    get_router().start()
+    return registry
 
 def init_session_state():
     """
@@ -13,115 +94,192 @@ def init_session_state():
         st.session_state.logged_in = False
     if "username" not in st.session_state:
         st.session_state.username = ""
-    if "conversations" not in st.session_state:
-        # Estructura: { usuario: { carpeta: [ {"user": ..., "bot": ...}, ... ] } }
-        st.session_state.conversations = {}
+    if "folders" not in st.session_state:
+        # Estructura: { carpeta: [conversación, ...] } del usuario actual, sin mensajes.
+        # Los mensajes se leen al abrir cada conversación (ver get_conversation_turns)
+        st.session_state.folders = {}
     if "current_folder" not in st.session_state:
         st.session_state.current_folder = "General"
 
-def process_token(token, in_think):
-    """
-    Procesa un token, eliminando (no mostrando) el contenido que se encuentre entre
-    las etiquetas <think> y </think>. Si está dentro de <think>, activa el estado de "pensando...".
-    
-    Retorna una tupla: (texto_a_mostrar, nuevo_estado_in_think).
-    """
-    text_to_display = ""
-    # Si ya estamos dentro de un bloque <think>, buscamos el cierre
-    if in_think:
-        if "</think>" in token:
-            parts = token.split("</think>", 1)
-            in_think = False
-            text_to_display = parts[1]  # Muestra lo que venga después del cierre
-        else:
-            text_to_display = ""  # No mostrar nada mientras esté en <think>
-    else:
-        if "<think>" in token:
-            parts = token.split("<think>", 1)
-            text_to_display = parts[0]  # Muestra lo anterior a la etiqueta
-            # Verificar si el cierre está en el mismo token
-            if "</think>" in parts[1]:
-                inner_parts = parts[1].split("</think>", 1)
-                text_to_display += inner_parts[1]
-            else:
-                in_think = True  # Se inicia un bloque <think>
-                text_to_display = ""  # No mostrar contenido dentro de <think>
-        else:
-            text_to_display = token
-    return text_to_display, in_think
-
 def deepseek_response_streaming(user_message):
     """
-    Función que simula la respuesta del LLM integrando una llamada a la API de Ollama.
-    Durante el streaming, se oculta el contenido entre <think> y </think>, y se muestra 
-    "⏳ Pensando..." una sola vez mientras el modelo está procesando.
+    Llama a la API de chat de Ollama en modo streaming, enviando el historial de la
+    conversación (ver build_messages) y mostrando la respuesta a medida que llega.
+    Durante el streaming, el contenido entre <think> y </think> se separa de la respuesta
+    (ver streaming.ThinkParser): se muestra "⏳ Pensando..." una sola vez mientras el modelo
+    razona y, si SHOW_REASONING está activado, el razonamiento en un desplegable.
+    Retorna la respuesta, o None si la petición se cancela, falla o no cabe en la cola
+    (el aviso se muestra).
     
-    Nota: Asegúrate de que Ollama está ejecutándose en "http://localhost:11434".
+    Nota: Asegúrate de que Ollama está ejecutándose en alguno de los servidores configurados
+    (OLLAMA_URL o OLLAMA_BACKENDS).
     """
-    # Mensaje del sistema
-    system_message = "Eres un asistente útil. Tus respuestas deben ser en español."
-    
-    # Construir el prompt combinando el system message y el mensaje del usuario
-    prompt = f"System: {system_message}\nUser: {user_message}\nAssistant:"
+    model = get_current_model()
+    messages = build_messages(user_message)
+
+    # Reutilizar la respuesta si la misma petición ya está en la caché
+    cache_key = response_cache_key(messages, model)
+    if cache_key is not None:
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            remember_reasoning("")
+            return cached
 
     # Construir el payload para la API de Ollama
     payload = {
-        "model": "deepseek-r1:1.5b",
-        "prompt": prompt,
-        "stream": True
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE  # Mantener el modelo cargado entre turnos
     }
+    if MODEL_OPTIONS:
+        payload["options"] = MODEL_OPTIONS
 
-    url = "http://localhost:11434/api/generate"
+    parser = ThinkParser()  # Separa el razonamiento del texto visible
+    reasoning_parts = []    # Acumula el razonamiento recibido
+    think_shown = False     # Se asegura de que "⏳ Pensando..." solo se muestre una vez
     
-    full_response = ""   # Acumula la respuesta completa (con todo el contenido)
-    display_text = ""    # Acumula solo el texto a mostrar (filtrado)
-    in_think = False     # Bandera para saber si estamos dentro de un bloque <think>
-    think_shown = False  # Se asegura de que "⏳ Pensando..." solo se muestre una vez
-    
-    thinking_placeholder = st.empty()  # Placeholder para "pensando..."
-    response_placeholder = st.empty()  # Placeholder para la respuesta final
-
+    thinking_placeholder = st.empty()   # Placeholder para "pensando..."
+    reasoning_placeholder = st.empty()  # Placeholder para el desplegable del razonamiento
+    response_placeholder = st.empty()   # Placeholder para la respuesta final
+    renderer = StreamRenderer(response_placeholder)  # Acumula solo el texto a mostrar (filtrado)
+    reasoning_renderer = None
+    cancelled = False
+    error = None  # Mensaje de error, si la llamada falla
+
+    def handle(visible, reasoning):
+        nonlocal reasoning_renderer
+        if reasoning:
+            reasoning_parts.append(reasoning)
+            if SHOW_REASONING:
+                if reasoning_renderer is None:
+                    expander = reasoning_placeholder.expander("🧠 Razonamiento", expanded=False)
+                    reasoning_renderer = StreamRenderer(expander.empty())
+                reasoning_renderer.write(reasoning)
+        # Acumular el texto visible; el placeholder se actualiza por lotes
+        renderer.write(visible)
+
+    router = get_router()
+    router.record_use(model)
+    backend = None
+    call = ModelCallMetrics(model, "stream")  # Tiempos y tokens de la llamada
+    final = None  # Último mensaje de Ollama, con los contadores de tokens y tiempos
     try:
-        with requests.post(url, json=payload, stream=True) as response:
-            response.raise_for_status()
-            
-            for line in response.iter_lines(decode_unicode=True):
-                if line:
-                    try:
-                        data = json.loads(line)
-                        token = data.get("response")
-                        if token:
-                            full_response += token
-                            
-                            # Procesa el token para filtrar lo que esté entre <think> y </think>
-                            processed, new_in_think = process_token(token, in_think)
-                            
-                            # Si entramos en un bloque <think>, mostramos "⏳ Pensando..." solo una vez
-                            if not think_shown and not in_think and new_in_think:
-                                thinking_placeholder.text("⏳ Pensando...")
-                                think_shown = True  # Evita que se muestre más de una vez
-                            
-                            # Si ya terminamos el bloque <think>, eliminamos el mensaje de "pensando..."
-                            if in_think and not new_in_think:
-                                thinking_placeholder.text("")  # Borrar "pensando..."
-                            
-                            in_think = new_in_think  # Actualizar estado
-
-                            # Acumular solo el texto procesado
-                            display_text += processed
-                            # Actualizar el placeholder con el texto filtrado
-                            response_placeholder.text(display_text)
-                            
-                            time.sleep(0.05)  # Pequeño delay para mejorar la experiencia de streaming
-                    except json.JSONDecodeError:
-                        response_placeholder.text("No se pudo decodificar la línea: " + line)
+        with model_slot(model) as ticket:
+            call.started(ticket.queue_wait)
+            # El servidor se elige al obtener turno, según la carga en ese momento
+            backend = router.choose(model)
+            with backend.client.post("/api/chat", payload, stream=True) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    # Dejar de leer si la petición se ha cancelado (p. ej. se envió otro mensaje)
+                    if ticket.cancelled:
+                        cancelled = True
+                        break
+                    if line:
+                        try:
+                            data = json.loads(line)
+                            if data.get("error"):
+                                error = "Error del modelo: " + data["error"]
+                            if data.get("done"):
+                                final = data
+                            token = data.get("message", {}).get("content")
+                            if token:
+                                call.token()
+                                was_in_think = parser.in_think
+                                visible, reasoning = parser.feed(token)
+                                if visible.strip():
+                                    call.visible()
+                                handle(visible, reasoning)
+                                
+                                # Si entramos en un bloque <think>, mostramos "⏳ Pensando..." solo una vez
+                                if not think_shown and parser.in_think:
+                                    thinking_placeholder.text("⏳ Pensando...")
+                                    think_shown = True  # Evita que se muestre más de una vez
+                                
+                                # Si ya terminamos el bloque <think>, eliminamos el mensaje de "pensando..."
+                                if was_in_think and not parser.in_think:
+                                    thinking_placeholder.text("")  # Borrar "pensando..."
+                        except json.JSONDecodeError:
+                            error = "No se pudo decodificar la línea: " + line
+                handle(*parser.close())
+    except QueueFull:
+        call.finish(status="busy")
+        st.warning(BUSY_MESSAGE)  # Se avisa al usuario, pero no es una respuesta del modelo
+        return None
+    except RequestCancelled:
+        cancelled = True
     except requests.exceptions.RequestException as e:
-        response_placeholder.text("Error en la solicitud: " + str(e))
-    response_placeholder.text("")
-    return display_text
+        if backend is not None and isinstance(e, requests.exceptions.ConnectionError):
+            router.report_failure(backend)
+        error = "Error en la solicitud: " + str(e)
+    call.finish(final, status="cancelled" if cancelled else "error" if error else "ok")
+    # Quitar los elementos temporales: la respuesta se pinta con el historial
+    response_placeholder.empty()
+    reasoning_placeholder.empty()
+    thinking_placeholder.empty()
+    if cancelled:
+        return None
+    if error:
+        # El error se muestra fuera de los placeholders para que no se borre, y la
+        # respuesta incompleta no se guarda en el historial
+        st.error(error)
+        return None
+    remember_reasoning("".join(reasoning_parts))
+    bot_response = renderer.text.strip()
+    if cache_key is not None and bot_response:
+        get_response_cache().put(cache_key, bot_response)
+    return bot_response
+
+
+def response_cache_key(messages, model):
+    """
+    Retorna la clave de la caché de respuestas para `messages`, o None si la caché
+    está desactivada o las opciones del modelo no dan respuestas deterministas.
+    """
+    if RESPONSE_CACHE_ENABLED and is_cacheable(MODEL_OPTIONS):
+        return make_key(model, messages, MODEL_OPTIONS)
+    return None
+
+
+def get_session_key():
+    """
+    Retorna el identificador de la sesión de Streamlit actual.
+    """
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
 
 
-def send_message(stream=False):
+@contextmanager
+def model_slot(model):
+    """
+    Espera turno en el planificador para llamar a `model` y muestra la posición en
+    la cola mientras tanto. Una petición nueva de la misma sesión cancela la anterior.
+    """
+    queue_placeholder = st.empty()
+
+    def show_queue(position, wait):
+        queue_placeholder.info(f"⏳ En cola: posición {position}, espera estimada ~{wait:.0f} s")
+
+    try:
+        with get_scheduler().slot(st.session_state.username, model, get_session_key(),
+                                  on_update=show_queue) as ticket:
+            queue_placeholder.empty()
+            yield ticket
+    finally:
+        queue_placeholder.empty()
+
+
+def remember_reasoning(reasoning):
+    """
+    Guarda el razonamiento de la última respuesta para mostrarlo junto a la conversación.
+    """
+    st.session_state.last_reasoning = (
+        st.session_state.username, st.session_state.current_folder,
+        st.session_state.current_conversation, reasoning.strip()
+    )
+
+
+def send_message(stream=True):
     """
     Envía el mensaje del usuario al chatbot y almacena la respuesta en el historial de la conversación.
     """
@@ -132,121 +290,430 @@ def send_message(stream=False):
         else:
             bot_response = deepseek_response(user_input)
 
+        # La petición se canceló (p. ej. se envió otro mensaje antes de que terminase)
+        # o falló o el servidor estaba ocupado, y ya se ha avisado: no hay turno que guardar
+        if bot_response is None:
+            return
+
         # Obtener el usuario, carpeta y conversación actual
         username = st.session_state.username
         folder = st.session_state.current_folder
         conversation = st.session_state.current_conversation
 
-        # Guardar el mensaje en la conversación seleccionada
-        st.session_state.conversations[username][folder][conversation].append({
+        # Guardar el mensaje en la conversación seleccionada (solo se escribe el turno nuevo)
+        store = get_store()
+        store.append_turn(username, folder, conversation, user_input, bot_response)
+        # append_turn crea la conversación si no existía (p. ej. se borró en otra pestaña)
+        conversations = st.session_state.folders.setdefault(folder, [])
+        if conversation not in conversations:
+            conversations.append(conversation)
+        conversation_id = store.get_conversation_id(username, folder, conversation)
+        get_conversation_cache().append(conversation_id, {
             "user": user_input,
             "bot": bot_response
         })
 
-        # 🔹 Guardar historial comprimido y actualizar la interfaz
-        update_conversations()
+        # Actualizar en segundo plano el resumen de los turnos antiguos, si está activado
+        if SUMMARY_ENABLED:
+            turns = get_conversation_turns(folder, conversation)
+            get_summarizer().schedule(store, conversation_id, turns, get_current_model())
+
+        # Calcular en segundo plano el embedding del turno nuevo, si la recuperación está activada
+        if RAG_ENABLED:
+            get_retriever().schedule(get_store(), username)
 
         # Limpiar la entrada
         st.session_state.user_input = ""
 
 
-def deepseek_response(user_message):
+def build_messages(user_message):
     """
-    Llama a la API de DeepSeek sin streaming, enviando todo el historial de la conversación.
+    Construye los mensajes para /api/chat con el historial de la conversación actual
+    que cabe en el presupuesto de tokens (ver context.build_context). Si el resumen
+    está activado, los turnos antiguos se sustituyen por su resumen; si la recuperación
+    está activada, se añaden turnos relevantes de otras conversaciones del usuario.
     """
     username = st.session_state.username
     folder = st.session_state.current_folder
     conversation = st.session_state.current_conversation
 
     # Recuperar el historial de mensajes de la conversación actual
-    conversation_history = st.session_state.conversations[username][folder][conversation]
+    conversation_history = get_conversation_turns(folder, conversation)
 
-    # Construcción de la lista de mensajes en formato esperado por la API
-    messages = [{"role": "system", "content": "Eres un asistente útil. Tus respuestas deben ser en español."}]
-    for msg in conversation_history:
-        messages.append({"role": "user", "content": msg["user"]})
-        messages.append({"role": "assistant", "content": msg["bot"]})
+    store = get_store()
+    conversation_id = store.get_conversation_id(username, folder, conversation)
 
-    # Agregar el nuevo mensaje del usuario
-    messages.append({"role": "user", "content": user_message})
+    summary = ""
+    if SUMMARY_ENABLED and conversation_id is not None:
+        summary, conversation_history = get_summarizer().split(store, conversation_id, conversation_history)
 
-    payload = {
-        "model": "deepseek-r1:1.5b",
-        "messages": messages,
-        "stream": False  # Desactiva el streaming para recibir la respuesta completa
-    }
+    # Turnos parecidos de otras conversaciones del usuario
+    related = []
+    if RAG_ENABLED:
+        related = get_retriever().related_turns(store, username, user_message, conversation_id)
 
-    url = "http://localhost:11434/api/chat"
+    messages, prompt_tokens = build_context(
+        SYSTEM_MESSAGE, conversation_history, user_message, summary=summary, related=related
+    )
+    st.session_state.last_prompt_tokens = prompt_tokens
+    return messages
 
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
 
-        # Extraer la respuesta del asistente
-        bot_response = data.get("message", {}).get("content", "").strip()
+def deepseek_response(user_message):
+    """
+    Llama a la API de DeepSeek sin streaming, enviando el historial de la conversación
+    que cabe en el presupuesto de tokens (ver build_messages). Retorna None si la
+    petición se cancela, falla o no cabe en la cola (el aviso se muestra).
+    """
+    model = get_current_model()
+    messages = build_messages(user_message)
+
+    # Reutilizar la respuesta si la misma petición ya está en la caché
+    cache_key = response_cache_key(messages, model)
+    if cache_key is not None:
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            remember_reasoning("")
+            return cached
 
-        # Filtrar contenido no deseado (como <think>...</think>)
-        bot_response = re.sub(r'<think>.*?</think>', '', bot_response, flags=re.DOTALL).strip()
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": False,  # Desactiva el streaming para recibir la respuesta completa
+        "keep_alive": OLLAMA_KEEP_ALIVE
+    }
+    if MODEL_OPTIONS:
+        payload["options"] = MODEL_OPTIONS
 
+    router = get_router()
+    router.record_use(model)
+    backend = None
+    call = ModelCallMetrics(model, "chat")  # Tiempos y tokens de la llamada
+    try:
+        with model_slot(model) as ticket:
+            call.started(ticket.queue_wait)
+            backend = router.choose(model)
+            with backend.client.post("/api/chat", payload) as response:
+                data = response.json()
+
+        # Extraer la respuesta del asistente, separando el razonamiento (<think>...</think>)
+        bot_response, reasoning = split_think(data.get("message", {}).get("content", ""))
+        remember_reasoning(reasoning)
+        call.finish(data)
+
+        if cache_key is not None and bot_response:
+            get_response_cache().put(cache_key, bot_response)
         return bot_response
 
-    except requests.exceptions.RequestException as e:
-        return f"Error en la solicitud: {str(e)}"
+    except QueueFull:
+        call.finish(status="busy")
+        st.warning(BUSY_MESSAGE)  # Se avisa al usuario, pero no es una respuesta del modelo
+        return None
+    except RequestCancelled:
+        call.finish(status="cancelled")
+        return None
+    except requests.exceptions.RequestException as e:  # Incluye el JSON inválido (JSONDecodeError)
+        call.finish(status="error")
+        if backend is not None and isinstance(e, requests.exceptions.ConnectionError):
+            router.report_failure(backend)
+        # Como en streaming: el error se muestra y no se guarda como respuesta
+        st.error(f"Error en la solicitud: {str(e)}")
+        return None
 
 
 
 def login_user(username):
     """
-    Registra el usuario en el estado de sesión y crea la estructura de conversaciones.
+    Registra el usuario en el estado de sesión y carga la estructura de sus carpetas
+    y conversaciones (sin los mensajes).
     """
     st.session_state.logged_in = True
     st.session_state.username = username
-    if username not in st.session_state.conversations:
-        st.session_state.conversations[username] = {"General": []}
-    st.session_state.current_folder = "General"
+    load_user_tree(username)
+    st.session_state.current_folder = DEFAULT_FOLDER
+
+    # Indexar los turnos que aún no tengan embedding (p. ej. los migrados o importados)
+    if RAG_ENABLED:
+        get_retriever().schedule(get_store(), username)
+
+def logout_user():
+    """
+    Cierra la sesión del usuario y olvida el estado ligado a él (razonamiento de la
+    última respuesta, historial visible, trabajos vistos), para que no lo vea quien
+    inicie sesión después en el mismo navegador.
+    """
+    st.session_state.logged_in = False
+    st.session_state.username = None
+    st.session_state.folders = {}
+    st.session_state.current_folder = DEFAULT_FOLDER
+    st.session_state.current_conversation = DEFAULT_CONVERSATION
+    for key in ("last_reasoning", "last_prompt_tokens", "visible_turns", "download_job",
+                "finished_archive_jobs", "bulk_message"):
+        st.session_state.pop(key, None)
+
+def load_user_tree(username):
+    """
+    Carga desde la base de datos las carpetas y conversaciones del usuario.
+    Los mensajes se cargan de forma perezosa al abrir cada conversación.
+    """
+    store = get_store()
+    store.ensure_user(username)
+    st.session_state.folders = store.get_tree(username)
+
+def get_conversation_turns(folder, conversation):
+    """
+    Retorna la lista de mensajes de una conversación del usuario actual. Los mensajes
+    no se guardan en la sesión sino en la caché compartida (ver conversation_cache),
+    que los lee de la base de datos si no los tiene. La lista no se debe modificar.
+    """
+    username = st.session_state.username
+    store = get_store()
+    conversation_id = store.get_conversation_id(username, folder, conversation)
+    if conversation_id is None:
+        return []
+    return get_conversation_cache().get(
+        conversation_id, lambda: store.load_turns(username, folder, conversation)
+    )
+
+def get_visible_turn_count(folder, conversation):
+    """
+    Retorna cuántos turnos recientes de la conversación se muestran en el historial.
+    """
+    return st.session_state.get("visible_turns", {}).get((folder, conversation), HISTORY_PAGE_SIZE)
+
+def load_older_turns(folder, conversation):
+    """
+    Amplía el historial visible de la conversación con una página más de turnos anteriores.
+    """
+    visible_turns = st.session_state.setdefault("visible_turns", {})
+    visible_turns[(folder, conversation)] = get_visible_turn_count(folder, conversation) + HISTORY_PAGE_SIZE
+
+def render_turn(user, bot):
+    """
+    Retorna el markdown de un turno del historial, para pintarlo con un solo st.markdown.
+    """
+    return f"**Tú:** {user}\n\n**Chatbot:** {bot}\n\n---"
+
+def search_conversations(query, limit=10):
+    """
+    Busca el texto en todas las conversaciones del usuario actual (ver ConversationStore.search).
+    """
+    return get_store().search(st.session_state.username, query, limit)
+
+def open_search_hit(folder, conversation, position):
+    """
+    Abre la conversación de un resultado de búsqueda mostrando el historial
+    al menos desde el turno encontrado.
+    """
+    st.session_state.current_folder = folder
+    st.session_state.current_conversation = conversation
+    turns = get_conversation_turns(folder, conversation)
+    visible_turns = st.session_state.setdefault("visible_turns", {})
+    visible_turns[(folder, conversation)] = max(
+        get_visible_turn_count(folder, conversation), len(turns) - position
+    )
 
 def create_folder(username, folder_name):
     """
     Crea una nueva carpeta para el usuario si no existe.
     Retorna True si se crea la carpeta, o False en caso contrario.
     """
-    if folder_name not in st.session_state.conversations[username]:
-        st.session_state.conversations[username][folder_name] = []
+    if get_store().create_folder(username, folder_name):
+        st.session_state.folders[folder_name] = [DEFAULT_CONVERSATION]
         st.session_state.current_folder = folder_name
         return True
     return False
 
+def rename_folder(username, old_name, new_name):
+    """
+    Renombra una carpeta del usuario. Retorna False si el nombre nuevo ya existe.
+    """
+    if not get_store().rename_folder(username, old_name, new_name):
+        return False
+    st.session_state.folders = {
+        new_name if folder == old_name else folder: conversations
+        for folder, conversations in st.session_state.folders.items()
+    }
+    return True
+
+def create_conversation(username, folder, conversation_name):
+    """
+    Crea una conversación vacía en la carpeta. Retorna False si ya existe.
+    """
+    if get_store().create_conversation(username, folder, conversation_name):
+        st.session_state.folders[folder].append(conversation_name)
+        return True
+    return False
+
+def rename_conversation(username, folder, old_name, new_name):
+    """
+    Renombra una conversación de la carpeta. Retorna False si el nombre nuevo ya existe.
+    """
+    if not get_store().rename_conversation(username, folder, old_name, new_name):
+        return False
+    conversations = st.session_state.folders[folder]
+    conversations[conversations.index(old_name)] = new_name
+    return True
+
+def get_current_model():
+    """
+    Retorna el modelo de la conversación actual: el elegido para ella, si no el de
+    su carpeta y, si tampoco, el modelo por defecto (MODEL_NAME).
+    """
+    folder_model, conversation_model = get_model_settings(
+        st.session_state.username, st.session_state.current_folder, st.session_state.current_conversation
+    )
+    return conversation_model or folder_model or MODEL_NAME
+
+def get_model_settings(username, folder, conversation):
+    """
+    Retorna (modelo de la carpeta, modelo de la conversación); None si no se eligió.
+    """
+    return get_store().get_models(username, folder, conversation)
+
+def get_available_models():
+    """
+    Retorna los modelos que se pueden elegir para una carpeta o conversación.
+    """
+    return get_router().available_models()
+
+def set_folder_model(username, folder, model):
+    """
+    Elige el modelo de la carpeta (None = el modelo por defecto).
+    """
+    get_store().set_folder_model(username, folder, model)
+
+def set_conversation_model(username, folder, conversation, model):
+    """
+    Elige el modelo de la conversación (None = el de su carpeta).
+    """
+    get_store().set_conversation_model(username, folder, conversation, model)
+
 def get_user_folders(username):
     """
     Retorna la lista de carpetas existentes para el usuario.
     """
-    return list(st.session_state.conversations[username].keys())
+    return list(st.session_state.folders)
+
+def refresh_user_tree(username):
+    """
+    Vuelve a cargar las carpetas y conversaciones del usuario tras una operación en
+    bloque y, si la carpeta o la conversación actuales ya no existen, elige otras.
+    """
+    load_user_tree(username)
+    folders = st.session_state.folders
+    if st.session_state.current_folder not in folders:
+        st.session_state.current_folder = DEFAULT_FOLDER
+    conversations = folders.get(st.session_state.current_folder, [])
+    if st.session_state.get("current_conversation") not in conversations:
+        st.session_state.current_conversation = conversations[0] if conversations else DEFAULT_CONVERSATION
+
+def move_conversations(username, folder, conversations, target_folder):
+    """
+    Mueve varias conversaciones a otra carpeta, que se crea si no existe.
+    Retorna la lista de conversaciones movidas (no se mueven las que ya existen en el destino).
+    """
+    moved = get_store().move_conversations(username, folder, conversations, target_folder)
+    # Seguir a la conversación actual si se ha movido
+    if folder == st.session_state.current_folder and st.session_state.current_conversation in moved:
+        st.session_state.current_folder = target_folder
+    refresh_user_tree(username)
+    return moved
+
+def rename_conversations(username, folder, conversations, old_text, new_text):
+    """
+    Renombra varias conversaciones reemplazando `old_text` por `new_text` en su nombre.
+    Retorna { nombre: nombre_nuevo } de las renombradas (no se renombran las que chocarían).
+    """
+    renames = {conversation: conversation.replace(old_text, new_text).strip() for conversation in conversations}
+    renames = {old: new for old, new in renames.items() if new and new != old}
+    renamed = get_store().rename_conversations(username, folder, renames)
+    if folder == st.session_state.current_folder and st.session_state.current_conversation in renamed:
+        st.session_state.current_conversation = renamed[st.session_state.current_conversation]
+    refresh_user_tree(username)
+    return renamed
+
+def delete_conversations(username, folder, conversations):
+    """
+    Borra varias conversaciones con sus mensajes. Retorna cuántas se han borrado.
+    """
+    deleted = get_store().delete_conversations(username, folder, conversations)
+    for conversation_id in deleted:
+        get_conversation_cache().discard(conversation_id)
+    refresh_user_tree(username)
+    return len(deleted)
 
+def delete_folder(username, folder):
+    """
+    Borra una carpeta con todas sus conversaciones. La carpeta por defecto no se
+    puede borrar. Retorna True si se borra la carpeta, o False en caso contrario.
+    """
+    if folder == DEFAULT_FOLDER:
+        return False
+    deleted = get_store().delete_folder(username, folder)
+    for conversation_id in deleted:
+        get_conversation_cache().discard(conversation_id)
+    refresh_user_tree(username)
+    return True
+
+def start_export(folders=None, all_users=False):
+    """
+    Exporta en segundo plano las carpetas indicadas del usuario actual (todas si no
+    se indica ninguna) o, solo para administradores, las de todos los usuarios.
+    Retorna el trabajo (ver archive.ArchiveJob), o None si no está permitido.
+    """
+    username = st.session_state.username
+    if all_users and username not in ADMIN_USERS:
+        return None
+    description = "Todos los usuarios" if all_users else ", ".join(folders or []) or "Todas las carpetas"
+    return get_archive_worker().export(
+        get_store(), username, None if all_users else username, folders, description
+    )
 
-def save_conversations():
+def start_import(uploaded_file, restore_users=False):
     """
-    Guarda las conversaciones en formato JSON comprimido en session_state.
+    Copia el archivo subido a disco por bloques e importa su contenido en segundo plano,
+    en las carpetas del usuario actual o, con `restore_users` (solo administradores),
+    para los usuarios indicados en el archivo. Retorna el trabajo, o None si no está permitido.
     """
-    st.session_state.conversations_json = json.dumps(
-        st.session_state.conversations, separators=(',', ':')  # Sin espacios innecesarios
+    username = st.session_state.username
+    if restore_users and username not in ADMIN_USERS:
+        return None
+    worker = get_archive_worker()
+    path = worker.new_path(".upload.jsonl.gz")
+    with open(path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, 1024 * 1024)
+    return worker.import_file(
+        get_store(), username, path, None if restore_users else username, uploaded_file.name
     )
 
-def load_conversations():
+def get_archive_jobs():
     """
-    Carga las conversaciones desde JSON comprimido.
+    Retorna las exportaciones e importaciones del usuario actual, de la más reciente a la más antigua.
     """
-    if "conversations_json" in st.session_state and st.session_state.conversations_json:
-        try:
-            st.session_state.conversations = json.loads(st.session_state.conversations_json)
-        except json.JSONDecodeError:
-            st.session_state.conversations = {}  # En caso de error, inicializa vacío
+    return get_archive_worker().jobs_for(st.session_state.username)
 
-def update_conversations():
+def read_archive(path):
     """
-    Marca el estado para una actualización en la siguiente iteración del script.
+    Lee un archivo exportado para el botón de descarga. Streamlit guarda en memoria los
+    datos de cada descarga, así que las copias de todos los usuarios grandes es mejor
+    copiarlas directamente del servidor (ARCHIVE_DIR).
     """
-    save_conversations()
-    st.session_state.should_rerun = True  # 🔹 Indicamos que se debe hacer un `rerun`
+    with open(path, "rb") as f:
+        return f.read()
 
 
+def load_conversations():
+    """
+    Migra las conversaciones guardadas en el antiguo formato JSON comprimido
+    (`conversations_json`) a la base de datos y elimina esa copia de la sesión.
+    """
+    if "conversations_json" in st.session_state:
+        conversations_json = st.session_state.pop("conversations_json")
+        if conversations_json:
+            try:
+                get_store().import_tree(json.loads(conversations_json))
+            except json.JSONDecodeError:
+                pass  # Datos corruptos: no hay nada que migrar
+        if st.session_state.get("username"):
+            load_user_tree(st.session_state.username)
@@ -0,0 +1,242 @@
+"""
+Servidores de Ollama disponibles y elección del servidor de cada petición.
+
+Un hilo en segundo plano comprueba periódicamente cada servidor con /api/tags
+(modelos instalados) y /api/ps (modelos cargados en memoria). Cada petición va al
+servidor sano menos cargado que tenga el modelo, prefiriendo los que ya lo tienen
+cargado. Los modelos de PRELOAD_MODELS, los WARM_MODELS más usados y, si la
+recuperación está activada, el modelo de embeddings se cargan por adelantado, para
+que el primer mensaje no pague el tiempo de carga del modelo.
+"""
+import threading
+import time
+from collections import Counter
+
+import requests
+
+from config import (
+    AVAILABLE_MODELS,
+    EMBEDDING_MODEL,
+    HEALTH_CHECK_INTERVAL,
+    OLLAMA_BACKENDS,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_KEEP_ALIVE,
+    PRELOAD_MODELS,
+    RAG_ENABLED,
+    SCHEDULER_MAX_CONCURRENCY,
+    WARM_MODELS,
+)
+from ollama_client import get_client
+from scheduler import get_scheduler
+
+# Timeout de lectura (segundos) de las comprobaciones de estado
+CHECK_READ_TIMEOUT = 5
+
+
+def model_names(entries):
+    """
+    Nombres de los modelos de una respuesta de /api/tags o /api/ps. Los modelos
+    con la etiqueta `latest` también se pueden pedir sin ella.
+    """
+    names = set()
+    for entry in entries:
+        for name in (entry.get("name"), entry.get("model")):
+            if name:
+                names.add(name)
+                names.add(name.removesuffix(":latest"))
+    return names
+
+
+class Backend:
+    """
+    Un servidor de Ollama y lo último que se sabe de él.
+    """
+
+    def __init__(self, name, url, models=None):
+        self.name = name
+        self.url = url
+        self.models = set(models) if models else None  # None = cualquier modelo instalado
+        self.healthy = True  # Se asume sano hasta la primera comprobación
+        self.installed = set()
+        self.loaded = set()
+        self.checked = None
+
+    @property
+    def client(self):
+        return get_client(self.url)
+
+    def serves(self, model):
+        """
+        Indica si el servidor puede atender peticiones a `model`.
+        """
+        if self.models is not None and model not in self.models:
+            return False
+        # Antes de la primera comprobación no se sabe qué modelos tiene instalados
+        return self.checked is None or model in self.installed
+
+    def load(self):
+        """
+        Fracción de las peticiones simultáneas permitidas que están en curso.
+        """
+        client = self.client
+        return client.in_flight / client.max_in_flight
+
+    def check(self):
+        """
+        Actualiza el estado del servidor. Retorna True si responde.
+        """
+        timeout = (OLLAMA_CONNECT_TIMEOUT, CHECK_READ_TIMEOUT)
+        try:
+            installed = self.client.get("/api/tags", timeout).get("models", [])
+            loaded = self.client.get("/api/ps", timeout).get("models", [])
+        except (requests.exceptions.RequestException, ValueError):
+            self.healthy = False
+        else:
+            self.installed = model_names(installed)
+            self.loaded = model_names(loaded)
+            self.healthy = True
+        self.checked = time.monotonic()
+        return self.healthy
+
+    def preload(self, model):
+        """
+        Carga `model` en memoria sin generar nada (petición sin prompt, o sin textos
+        para el modelo de embeddings, que no admite /api/generate).
+        """
+        if model == EMBEDDING_MODEL:
+            path, payload = "/api/embed", {"model": model, "input": [], "keep_alive": OLLAMA_KEEP_ALIVE}
+        else:
+            path, payload = "/api/generate", {"model": model, "keep_alive": OLLAMA_KEEP_ALIVE}
+        with self.client.post(path, payload):
+            pass
+        self.loaded.add(model)
+
+
+class BackendRouter:
+    """
+    Elige servidor para cada petición y mantiene los modelos más usados cargados.
+    """
+
+    def __init__(self, backends=OLLAMA_BACKENDS, interval=HEALTH_CHECK_INTERVAL):
+        self.backends = [
+            Backend(backend.get("name", backend["url"]), backend["url"], backend.get("models"))
+            for backend in backends
+        ]
+        self.interval = interval
+        self._usage = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """
+        Arranca las comprobaciones periódicas en segundo plano (una sola vez).
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="backends")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        """
+        Comprueba todos los servidores, ajusta la concurrencia por modelo en el
+        planificador y carga los modelos que deben estar calientes.
+        """
+        for backend in self.backends:
+            backend.check()
+        for model in set(self.available_models()) | set(self.warm_models()):
+            servers = sum(1 for backend in self.backends if backend.healthy and backend.serves(model))
+            get_scheduler().set_capacity(model, SCHEDULER_MAX_CONCURRENCY * max(1, servers))
+        self.warm()
+
+    def choose(self, model):
+        """
+        Retorna el servidor para una petición a `model`: el sano menos cargado que lo
+        tenga, evitando los saturados y prefiriendo los que ya lo tienen cargado.
+        """
+        candidates = [backend for backend in self.backends if backend.healthy and backend.serves(model)]
+        if not candidates:
+            # Ninguno parece disponible: probar con los que podrían tenerlo, y que el
+            # error (si lo hay) llegue al usuario como con un único servidor
+            candidates = [
+                backend for backend in self.backends if backend.models is None or model in backend.models
+            ] or self.backends
+        return min(
+            candidates,
+            key=lambda backend: (backend.load() >= 1, model not in backend.loaded, backend.load()),
+        )
+
+    def client_for(self, model):
+        return self.choose(model).client
+
+    def record_use(self, model):
+        with self._lock:
+            self._usage[model] += 1
+
+    def report_failure(self, backend):
+        """
+        Marca un servidor como caído hasta la próxima comprobación.
+        """
+        backend.healthy = False
+
+    def available_models(self):
+        """
+        Modelos que se pueden elegir para una carpeta o conversación.
+        """
+        models = list(AVAILABLE_MODELS)
+        for backend in self.backends:
+            models.extend(sorted(backend.models or ()))
+        return list(dict.fromkeys(models))
+
+    def warm_models(self):
+        """
+        Modelos que se mantienen cargados: los configurados, los más usados y el de
+        embeddings si la recuperación está activada (se usa antes de cada petición).
+        """
+        with self._lock:
+            frequent = [model for model, _ in self._usage.most_common(WARM_MODELS)]
+        embedding = [EMBEDDING_MODEL] if RAG_ENABLED else []
+        return list(dict.fromkeys(PRELOAD_MODELS + frequent + embedding))
+
+    def warm(self):
+        for model in self.warm_models():
+            for backend in self.backends:
+                if backend.healthy and backend.serves(model) and model not in backend.loaded:
+                    try:
+                        backend.preload(model)
+                    except requests.exceptions.RequestException:
+                        pass  # Se reintentará en la próxima comprobación
+
+    def stats(self):
+        """
+        Retorna una fila por servidor con su estado, carga y modelos cargados.
+        """
+        return [
+            {
+                "servidor": backend.name,
+                "url": backend.url,
+                "sano": backend.healthy,
+                "en curso": backend.client.in_flight,
+                "cargados": ", ".join(sorted(backend.loaded)),
+            }
+            for backend in self.backends
+        ]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """
+    Retorna el enrutador compartido por todas las sesiones.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = BackendRouter()
+        return _router
@@ -0,0 +1,91 @@
+"""
+Coste de CPU en el servidor por mensaje enviado, según el tamaño del historial.
+
+Compara el flujo anterior (guardar todo el árbol con json.dumps, cargarlo con
+json.loads al inicio del script, un segundo rerun completo y pintar todos los
+turnos en cada ejecución) con el actual (insertar solo el turno nuevo y una única
+ejecución que pinta la última página del historial).
+
+No necesita Ollama: la respuesta del modelo se sustituye por un texto fijo.
+
+    python benchmarks/bench_message_flow.py [tamaño_historial ...]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import HISTORY_PAGE_SIZE, DEFAULT_FOLDER, DEFAULT_CONVERSATION  # noqa: E402
+from storage import ConversationStore  # noqa: E402
+from aux_functions import render_turn  # noqa: E402
+
+USERNAME = "bench"
+USER_TEXT = "¿Podrías explicarme cómo funciona esta parte del código? " * 3
+BOT_TEXT = "Claro. Esta parte del código se encarga de guardar la conversación. " * 12
+MESSAGES = 20
+
+
+def make_turns(count):
+    return [{"user": f"{i} {USER_TEXT}", "bot": f"{i} {BOT_TEXT}"} for i in range(count)]
+
+
+def render_all_before(turns):
+    # Antes: tres st.markdown por turno, para todos los turnos
+    return [
+        (f"**Tú:** {entry['user']}", f"**Chatbot:** {entry['bot']}", "---") for entry in turns
+    ]
+
+
+def message_before(state):
+    """
+    send_message -> update_conversations (json.dumps) -> ejecución con
+    load_conversations (json.loads) y st.rerun -> segunda ejecución completa.
+    """
+    state["conversations"][USERNAME][DEFAULT_FOLDER][DEFAULT_CONVERSATION].append(
+        {"user": USER_TEXT, "bot": BOT_TEXT}
+    )
+    state["conversations_json"] = json.dumps(state["conversations"], separators=(',', ':'))
+    for _ in range(2):
+        state["conversations"] = json.loads(state["conversations_json"])
+        render_all_before(state["conversations"][USERNAME][DEFAULT_FOLDER][DEFAULT_CONVERSATION])
+
+
+def message_after(store, turns):
+    """
+    send_message inserta el turno nuevo -> una ejecución que pinta la última página.
+    """
+    store.append_turn(USERNAME, DEFAULT_FOLDER, DEFAULT_CONVERSATION, USER_TEXT, BOT_TEXT)
+    turns.append({"user": USER_TEXT, "bot": BOT_TEXT})
+    for entry in turns[-HISTORY_PAGE_SIZE:]:
+        render_turn(entry["user"], entry["bot"])
+
+
+def cpu_per_message(function, *args):
+    start = time.process_time()
+    for _ in range(MESSAGES):
+        function(*args)
+    return (time.process_time() - start) / MESSAGES * 1000
+
+
+def main(sizes):
+    print(f"{'turnos':>8} {'antes (ms)':>12} {'después (ms)':>13}")
+    for size in sizes:
+        turns = make_turns(size)
+        state = {"conversations": {USERNAME: {DEFAULT_FOLDER: {DEFAULT_CONVERSATION: list(turns)}}}}
+        before = cpu_per_message(message_before, state)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = ConversationStore(os.path.join(directory, "bench.db"))
+            store.import_tree({USERNAME: {DEFAULT_FOLDER: {DEFAULT_CONVERSATION: turns}}})
+            after_turns = store.load_turns(USERNAME, DEFAULT_FOLDER, DEFAULT_CONVERSATION)
+            after = cpu_per_message(message_after, store, after_turns)
+            store.close()
+
+        print(f"{size:>8} {before:>12.2f} {after:>13.2f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 5000])
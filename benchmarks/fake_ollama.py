@@ -0,0 +1,163 @@
+"""
+Servidor HTTP local que imita a Ollama para pruebas de rendimiento sin GPU ni red.
+
+Responde a /api/chat y /api/generate (con y sin streaming NDJSON), /api/embed,
+/api/tags y /api/ps. La respuesta empieza con un bloque <think>, sus tokens se
+emiten a un ritmo configurable y, opcionalmente, las etiquetas se parten entre
+fragmentos (`<thi` + `nk>`) como hacen los modelos reales.
+
+    python benchmarks/fake_ollama.py --port 11435 --rate 50
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "el modelo responde en español con frases cortas y claras sobre la pregunta "
+    "del usuario usando datos de la conversación anterior cuando hace falta"
+).split()
+
+EMBEDDING_DIM = 64
+
+
+class FakeOllamaConfig:
+    """
+    Parámetros de las respuestas simuladas.
+    """
+
+    def __init__(self, rate=50.0, first_token_delay=0.05, think_tokens=20, answer_tokens=80,
+                 split_tags=True, model="deepseek-r1:1.5b"):
+        self.rate = rate                            # tokens por segundo (0 = sin espera)
+        self.first_token_delay = first_token_delay  # segundos hasta el primer token
+        self.think_tokens = think_tokens
+        self.answer_tokens = answer_tokens
+        self.split_tags = split_tags
+        self.model = model
+
+
+def make_tokens(config):
+    """
+    Tokens de una respuesta: bloque <think>, cierre y texto visible.
+    """
+    think = [WORDS[i % len(WORDS)] + " " for i in range(config.think_tokens)]
+    answer = [WORDS[(i * 7) % len(WORDS)] + " " for i in range(config.answer_tokens)]
+    if config.split_tags:
+        return ["<thi", "nk>"] + think + ["</th", "ink>\n\n"] + answer
+    return ["<think>"] + think + ["</think>\n\n"] + answer
+
+
+def fake_embedding(text):
+    """
+    Vector determinista a partir del hash del texto.
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(EMBEDDING_DIM)]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = FakeOllamaConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        model = {"name": self.config.model, "model": self.config.model, "size": 0}
+        if self.path in ("/api/tags", "/api/ps"):
+            self.send_json({"models": [model]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/embed":
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self.send_json({"model": payload.get("model"), "embeddings": [fake_embedding(t) for t in inputs]})
+        elif self.path in ("/api/chat", "/api/generate"):
+            self.generate(payload, chat=self.path == "/api/chat")
+        else:
+            self.send_error(404)
+
+    def generate(self, payload, chat):
+        config = self.config
+        tokens = make_tokens(config)
+        prompt_chars = sum(len(m.get("content", "")) for m in payload.get("messages", [])) if chat \
+            else len(payload.get("prompt", ""))
+        start = time.monotonic()
+        if config.first_token_delay:
+            time.sleep(config.first_token_delay)
+        stats = {"prompt_eval_count": prompt_chars // 4 + 1, "eval_count": len(tokens)}
+
+        def message(content):
+            return {"message": {"role": "assistant", "content": content}} if chat else {"response": content}
+
+        if not payload.get("stream", True):
+            if config.rate:
+                time.sleep(len(tokens) / config.rate)
+            stats["eval_duration"] = int((time.monotonic() - start) * 1e9)
+            self.send_json({"model": config.model, **message("".join(tokens)), "done": True, **stats})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            self.send_chunk({"model": config.model, **message(token), "done": False})
+            if config.rate:
+                time.sleep(1 / config.rate)
+        stats["eval_duration"] = int((time.monotonic() - start) * 1e9)
+        self.send_chunk({"model": config.model, **message(""), "done": True, **stats})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_fake_ollama(config=None, host="127.0.0.1", port=0):
+    """
+    Arranca el servidor en un hilo en segundo plano. Retorna (servidor, url).
+    Con `port=0` se usa un puerto libre.
+    """
+    handler = type("Handler", (FakeOllamaHandler,), {"config": config or FakeOllamaConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-ollama").start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que imita a Ollama")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--rate", type=float, default=50.0, help="tokens por segundo (0 = sin espera)")
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--think-tokens", type=int, default=20)
+    parser.add_argument("--answer-tokens", type=int, default=80)
+    parser.add_argument("--no-split-tags", action="store_true")
+    args = parser.parse_args()
+    server, url = start_fake_ollama(
+        FakeOllamaConfig(args.rate, args.first_token_delay, args.think_tokens, args.answer_tokens,
+                         not args.no_split_tags),
+        port=args.port,
+    )
+    print(f"Ollama simulado en {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,281 @@
+"""
+Pruebas de rendimiento de los caminos críticos, sin GPU ni red.
+
+Arranca un Ollama simulado (ver fake_ollama.py) y mide, con historiales
+sintéticos de distintos tamaños:
+
+- almacenamiento: coste de guardar un mensaje y de cargar una conversación,
+  comparado con serializar todo el árbol como hacía `conversations_json`;
+- extremo a extremo: send_message de aux_functions (streaming y sin streaming),
+  con latencia, tiempo hasta el primer texto visible en la interfaz, tokens/s
+  entregados a la interfaz y memoria retenida por mensaje;
+- concurrencia: muchos usuarios simulados a la vez pasando por el planificador,
+  el cliente HTTP compartido, el parser de <think> y el renderizado por lotes.
+
+    python benchmarks/run_benchmarks.py --sizes 10 100 1000 10000 --users 50
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_ollama import FakeOllamaConfig, start_fake_ollama  # noqa: E402
+
+USER_TEXT = "¿Me explicas con un ejemplo cómo se usa esta función en el proyecto? "
+BOT_TEXT = "Por supuesto. La función recibe el historial y devuelve la respuesta del modelo. " * 6
+
+
+def make_turns(count, offset=0):
+    return [{"user": f"{offset + i} {USER_TEXT}", "bot": f"{offset + i} {BOT_TEXT}"} for i in range(count)]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def print_table(title, header, rows):
+    print(f"\n{title}")
+    widths = [max(len(str(h)), *(len(f"{r[i]:.2f}" if isinstance(r[i], float) else str(r[i])) for r in rows))
+              for i, h in enumerate(header)]
+    print("  ".join(str(h).rjust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        cells = [f"{v:.2f}" if isinstance(v, float) else str(v) for v in row]
+        print("  ".join(c.rjust(w) for c, w in zip(cells, widths)))
+
+
+class UIPlaceholder:
+    """
+    Sustituto de un placeholder de Streamlit que anota cuándo y cuánto texto se pinta.
+    """
+
+    def __init__(self):
+        self.updates = 0
+        self.first_visible = None
+        self.last_update = None
+        self.text_value = ""
+
+    def text(self, value):
+        now = time.perf_counter()
+        self.updates += 1
+        if value.strip() and self.first_visible is None:
+            self.first_visible = now
+        self.last_update = now
+        self.text_value = value
+
+    def empty(self):
+        pass
+
+
+def bench_storage(store, sizes, messages=50):
+    from config import DEFAULT_FOLDER
+
+    rows = []
+    for size in sizes:
+        username = f"storage_{size}"
+        turns = make_turns(size)
+        store.import_tree({username: {DEFAULT_FOLDER: {"bench": turns}}})
+
+        start = time.perf_counter()
+        for i in range(messages):
+            store.append_turn(username, DEFAULT_FOLDER, "bench", USER_TEXT, BOT_TEXT)
+        append_ms = (time.perf_counter() - start) / messages * 1000
+
+        start = time.perf_counter()
+        store.load_turns(username, DEFAULT_FOLDER, "bench")
+        load_ms = (time.perf_counter() - start) * 1000
+
+        tree = {username: {DEFAULT_FOLDER: {"bench": turns}}}
+        start = time.perf_counter()
+        blob = json.dumps(tree, separators=(',', ':'))
+        json.loads(blob)
+        legacy_ms = (time.perf_counter() - start) * 1000
+        rows.append((size, append_ms, load_ms, legacy_ms))
+    print_table(
+        "Almacenamiento (ms)",
+        ("turnos", "guardar mensaje", "abrir conversación", "antes: dumps+loads por mensaje"),
+        rows,
+    )
+
+
+def bench_end_to_end(sizes, messages):
+    import streamlit as st
+    import aux_functions
+    from config import DEFAULT_FOLDER
+
+    placeholders = []
+
+    class RecordingRenderer(aux_functions.StreamRenderer):
+        def __init__(self, placeholder, *args, **kwargs):
+            recorder = UIPlaceholder()
+            placeholders.append(recorder)
+            super().__init__(recorder, *args, **kwargs)
+
+    aux_functions.StreamRenderer = RecordingRenderer
+    # En modo bare Streamlit avisa de la falta de ScriptRunContext en cada acceso
+    # (y Streamlit restablece el nivel de sus loggers al leer su configuración)
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: record.levelno >= logging.ERROR
+    )
+    aux_functions.init_session_state()
+    aux_functions.login_user("bench_e2e")
+    store = aux_functions.get_store()
+
+    rows = []
+    for stream in (True, False):
+        for size in sizes:
+            conversation = f"e2e_{size}_{stream}"
+            store.import_tree({"bench_e2e": {DEFAULT_FOLDER: {conversation: make_turns(size)}}})
+            aux_functions.load_user_tree("bench_e2e")
+            st.session_state.current_folder = DEFAULT_FOLDER
+            st.session_state.current_conversation = conversation
+            aux_functions.get_conversation_turns(DEFAULT_FOLDER, conversation)
+
+            st.session_state.user_input = USER_TEXT
+            aux_functions.send_message(stream=stream)  # Calentamiento, no se mide
+
+            latencies, first_visible, rates = [], [], []
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            for i in range(messages):
+                placeholders.clear()
+                st.session_state.user_input = f"{i} {USER_TEXT}"
+                start = time.perf_counter()
+                aux_functions.send_message(stream=stream)
+                end = time.perf_counter()
+                latencies.append((end - start) * 1000)
+                ui = placeholders[0] if placeholders else None
+                if ui is not None and ui.first_visible is not None:
+                    first_visible.append((ui.first_visible - start) * 1000)
+                    visible_tokens = len(ui.text_value.split())
+                    if ui.last_update > ui.first_visible:
+                        rates.append(visible_tokens / (ui.last_update - ui.first_visible))
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            growth = sum(stat.size_diff for stat in after.compare_to(before, "filename")) / messages / 1024
+            rows.append((
+                "stream" if stream else "chat", size,
+                percentile(latencies, 0.5), percentile(latencies, 0.95),
+                percentile(first_visible, 0.5) if first_visible else "-",
+                percentile(rates, 0.5) if rates else "-",
+                growth,
+            ))
+    print_table(
+        "Extremo a extremo con send_message",
+        ("modo", "turnos", "p50 ms", "p95 ms", "1er visible ms", "tokens/s UI", "KiB/mensaje"),
+        rows,
+    )
+
+
+def simulate_user(username, history, results):
+    """
+    Mismo camino que deepseek_response_streaming, sin Streamlit: contexto acotado,
+    turno en el planificador, llamada en streaming, parser de <think> y renderizado por lotes.
+    """
+    from config import MODEL_NAME, SYSTEM_MESSAGE
+    from context import build_context
+    from ollama_client import get_client
+    from scheduler import get_scheduler
+    from streaming import StreamRenderer, ThinkParser
+
+    messages, _ = build_context(SYSTEM_MESSAGE, history, USER_TEXT)
+    payload = {"model": MODEL_NAME, "messages": messages, "stream": True}
+    ui = UIPlaceholder()
+    renderer = StreamRenderer(ui)
+    parser = ThinkParser()
+    start = time.perf_counter()
+    with get_scheduler().slot(username, MODEL_NAME) as ticket:
+        queue_wait = ticket.queue_wait
+        with get_client().post("/api/chat", payload, stream=True) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    token = json.loads(line).get("message", {}).get("content")
+                    if token:
+                        renderer.write(parser.feed(token)[0])
+            renderer.write(parser.close()[0])
+            renderer.flush()
+    end = time.perf_counter()
+    results.append({
+        "queue_wait": queue_wait * 1000,
+        "first_visible": ((ui.first_visible or end) - start) * 1000,
+        "latency": (end - start) * 1000,
+        "tokens": len(renderer.text.split()),
+        "updates": ui.updates,
+    })
+
+
+def bench_concurrent(users_list, history_size):
+    history = make_turns(history_size)
+    rows = []
+    for users in users_list:
+        results = []
+        threads = [
+            threading.Thread(target=simulate_user, args=(f"user_{i}", history, results))
+            for i in range(users)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        rows.append((
+            users,
+            percentile([r["queue_wait"] for r in results], 0.5),
+            percentile([r["queue_wait"] for r in results], 0.95),
+            percentile([r["first_visible"] for r in results], 0.5),
+            percentile([r["latency"] for r in results], 0.95),
+            sum(r["tokens"] for r in results) / elapsed,
+            percentile([r["updates"] for r in results], 0.5),
+        ))
+    print_table(
+        f"Usuarios concurrentes (historial de {history_size} turnos)",
+        ("usuarios", "cola p50 ms", "cola p95 ms", "1er visible p50 ms", "latencia p95 ms",
+         "tokens/s total", "repintados/resp."),
+        rows,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--messages", type=int, default=5, help="mensajes por tamaño en la prueba extremo a extremo")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--rate", type=float, default=200.0, help="tokens/s del Ollama simulado")
+    parser.add_argument("--first-token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server, url = start_fake_ollama(FakeOllamaConfig(rate=args.rate, first_token_delay=args.first_token_delay))
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    os.environ["OLLAMA_URL"] = url
+    os.environ["CHATBOT_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    os.environ["CHATBOT_RESPONSE_CACHE_PATH"] = os.path.join(workdir, "response_cache.db")
+    os.environ["CHATBOT_EMBEDDINGS_DIR"] = os.path.join(workdir, "embeddings")
+    os.environ.setdefault("CHATBOT_MAX_QUEUE", str(max(args.users) * 2))
+
+    # config.py lee el entorno al importarse, así que los módulos del proyecto
+    # se importan después de apuntar a Ollama simulado y al directorio temporal
+    from storage import ConversationStore
+
+    print(f"Ollama simulado en {url} ({args.rate:.0f} tokens/s), datos en {workdir}")
+    store = ConversationStore(os.path.join(workdir, "storage.db"))
+    bench_storage(store, args.sizes)
+    store.close()
+    bench_end_to_end(args.sizes, args.messages)
+    bench_concurrent(args.users, min(args.sizes[-1], 1000))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
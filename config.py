@@ -0,0 +1,107 @@
+"""
+Configuración de la aplicación, leída de variables de entorno.
+"""
+import json
+import os
+
+# Ruta de la base de datos SQLite donde se guardan las conversaciones
+DB_PATH = os.environ.get("CHATBOT_DB_PATH", "conversations.db")
+
+# Carpeta y conversación que todo usuario tiene siempre disponibles
+DEFAULT_FOLDER = "General"
+DEFAULT_CONVERSATION = "Conversación 1"
+
+# Servidor de Ollama y modelo por defecto
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+MODEL_NAME = os.environ.get("CHATBOT_MODEL", "deepseek-r1:1.5b")
+# Tiempo que Ollama mantiene el modelo cargado tras cada petición (p. ej. "30m", "-1" = siempre),
+# para no pagar la carga del modelo y reaprovechar la caché del prefijo entre turnos
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# Servidores de Ollama (opcional), como lista JSON de {"name": ..., "url": ..., "models": [...]}.
+# Un servidor sin "models" atiende cualquier modelo que tenga instalado. Por defecto, solo OLLAMA_URL
+OLLAMA_BACKENDS = json.loads(os.environ.get("CHATBOT_BACKENDS", "[]")) or [{"name": "local", "url": OLLAMA_URL}]
+# Modelos que se pueden elegir por carpeta o por conversación (separados por comas)
+AVAILABLE_MODELS = list(dict.fromkeys(
+    [MODEL_NAME] + [m.strip() for m in os.environ.get("CHATBOT_MODELS", "").split(",") if m.strip()]
+))
+# Modelos que se cargan al arrancar y se mantienen cargados, además de los WARM_MODELS más usados
+PRELOAD_MODELS = [m.strip() for m in os.environ.get("CHATBOT_PRELOAD_MODELS", MODEL_NAME).split(",") if m.strip()]
+WARM_MODELS = int(os.environ.get("CHATBOT_WARM_MODELS", "2"))
+# Cada cuántos segundos se comprueba el estado de los servidores (/api/tags y /api/ps)
+HEALTH_CHECK_INTERVAL = float(os.environ.get("CHATBOT_HEALTH_CHECK_INTERVAL", "15"))
+# Opciones del modelo enviadas a Ollama en formato JSON, p. ej. '{"temperature": 0, "seed": 42}'
+MODEL_OPTIONS = json.loads(os.environ.get("CHATBOT_MODEL_OPTIONS", "{}"))
+SYSTEM_MESSAGE = "Eres un asistente útil. Tus respuestas deben ser en español."
+
+# Cliente HTTP hacia Ollama: timeouts (segundos), reintentos ante errores de conexión
+# y número máximo de peticiones simultáneas por servidor
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_RETRIES = int(os.environ.get("OLLAMA_RETRIES", "3"))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", "0.5"))
+OLLAMA_MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", "4"))
+
+# Streaming: el texto recibido se pinta como mucho cada STREAM_FLUSH_INTERVAL
+# segundos, o antes si se acumulan STREAM_FLUSH_CHARS caracteres pendientes
+STREAM_FLUSH_INTERVAL = float(os.environ.get("CHATBOT_STREAM_FLUSH_INTERVAL", "0.05"))
+STREAM_FLUSH_CHARS = int(os.environ.get("CHATBOT_STREAM_FLUSH_CHARS", "512"))
+
+# Ventana de contexto: máximo de tokens enviados al modelo en cada petición y
+# número de turnos recientes que se envían siempre, aunque se supere el presupuesto
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CHATBOT_CONTEXT_TOKENS", "3072"))
+CONTEXT_MIN_RECENT_TURNS = int(os.environ.get("CHATBOT_CONTEXT_MIN_TURNS", "2"))
+
+# Resumen de turnos antiguos (opcional): se conservan literales los últimos
+# SUMMARY_KEEP_TURNS turnos y el resto se sustituye por un resumen, que se
+# actualiza cuando salen de la ventana al menos SUMMARY_MIN_NEW_TURNS turnos
+SUMMARY_ENABLED = os.environ.get("CHATBOT_SUMMARY", "0") == "1"
+SUMMARY_KEEP_TURNS = int(os.environ.get("CHATBOT_SUMMARY_KEEP_TURNS", "8"))
+SUMMARY_MIN_NEW_TURNS = int(os.environ.get("CHATBOT_SUMMARY_MIN_NEW_TURNS", "4"))
+
+# Mostrar el razonamiento (<think>) del modelo en un desplegable
+SHOW_REASONING = os.environ.get("CHATBOT_SHOW_REASONING", "1") == "1"
+
+# Planificador de peticiones al modelo: peticiones simultáneas por modelo,
+# máximo de peticiones en cola y duración estimada inicial de una respuesta (segundos)
+SCHEDULER_MAX_CONCURRENCY = int(os.environ.get("CHATBOT_MAX_CONCURRENCY", "2"))
+SCHEDULER_MAX_QUEUE = int(os.environ.get("CHATBOT_MAX_QUEUE", "64"))
+SCHEDULER_INITIAL_SERVICE_TIME = float(os.environ.get("CHATBOT_INITIAL_SERVICE_TIME", "10"))
+
+# Caché de respuestas (opcional): solo se usa si las opciones del modelo hacen que
+# la respuesta sea determinista (temperature 0 o una semilla fija)
+RESPONSE_CACHE_ENABLED = os.environ.get("CHATBOT_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_PATH = os.environ.get("CHATBOT_RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("CHATBOT_RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.environ.get("CHATBOT_RESPONSE_CACHE_TTL", str(24 * 3600)))
+
+# Historial: número de turnos que se muestran al abrir una conversación (y que se
+# añaden con cada "cargar anteriores")
+HISTORY_PAGE_SIZE = int(os.environ.get("CHATBOT_HISTORY_PAGE_SIZE", "20"))
+# Memoria máxima (bytes) de los mensajes de conversaciones abiertas, compartida por
+# todas las sesiones; las conversaciones usadas hace más tiempo se descartan primero
+CONVERSATION_CACHE_MAX_BYTES = int(os.environ.get("CHATBOT_CONVERSATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Recuperación de turnos relevantes de otras conversaciones del usuario (opcional):
+# los turnos se convierten en embeddings en segundo plano y, antes de cada petición,
+# se añaden como contexto los RAG_TOP_K más parecidos con similitud >= RAG_MIN_SCORE
+RAG_ENABLED = os.environ.get("CHATBOT_RAG", "0") == "1"
+EMBEDDING_MODEL = os.environ.get("CHATBOT_EMBEDDING_MODEL", "nomic-embed-text")
+EMBEDDINGS_DIR = os.environ.get("CHATBOT_EMBEDDINGS_DIR", "embeddings")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("CHATBOT_EMBEDDING_BATCH_SIZE", "32"))
+RAG_TOP_K = int(os.environ.get("CHATBOT_RAG_TOP_K", "3"))
+RAG_MIN_SCORE = float(os.environ.get("CHATBOT_RAG_MIN_SCORE", "0.5"))
+# Espera máxima (segundos) por un hueco en el servidor y por la respuesta del embedding
+# de la pregunta, que se calcula antes de cada petición: si se supera, se responde
+# sin recuperación
+RAG_QUERY_TIMEOUT = float(os.environ.get("CHATBOT_RAG_QUERY_TIMEOUT", "1"))
+
+# Exportación e importación de conversaciones: directorio de los archivos generados
+# y subidos, y turnos que se insertan por transacción al importar
+ARCHIVE_DIR = os.environ.get("CHATBOT_ARCHIVE_DIR", "archives")
+ARCHIVE_CHUNK_TURNS = int(os.environ.get("CHATBOT_ARCHIVE_CHUNK_TURNS", "500"))
+
+# Métricas: puerto opcional para exponerlas en formato Prometheus (/metrics), escribir
+# una línea de log por llamada al modelo, y usuarios que ven el panel de métricas
+METRICS_PORT = int(os.environ.get("CHATBOT_METRICS_PORT", "0"))
+METRICS_LOG = os.environ.get("CHATBOT_METRICS_LOG", "0") == "1"
+ADMIN_USERS = {user.strip() for user in os.environ.get("CHATBOT_ADMINS", "").split(",") if user.strip()}
@@ -0,0 +1,109 @@
+"""
+Construcción de la lista de mensajes que se envía al modelo, limitada a un
+presupuesto de tokens para que el coste de cada turno no crezca con el historial.
+"""
+import re
+
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_MIN_RECENT_TURNS
+
+THINK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+# Tokens extra que el formato de chat añade a cada mensaje (rol y separadores)
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PREFIX = "Resumen de la parte anterior de la conversación:\n"
+RELATED_PREFIX = "Fragmentos de otras conversaciones del usuario que pueden ser útiles:\n"
+
+
+def approx_token_count(text):
+    """
+    Estimación rápida de tokens (≈ 4 caracteres por token) para cuando no hay
+    un tokenizador disponible.
+    """
+    return len(text) // 4 + 1
+
+
+def tokenizer_counter(tokenizer):
+    """
+    Crea un contador de tokens a partir de cualquier tokenizador con método
+    `encode` (por ejemplo, uno de `transformers` o `tiktoken`).
+    """
+    return lambda text: len(tokenizer.encode(text))
+
+
+_token_counter = approx_token_count
+
+
+def set_token_counter(counter):
+    """
+    Cambia el contador de tokens usado por defecto en `build_context`.
+    """
+    global _token_counter
+    _token_counter = counter
+
+
+def strip_think(text):
+    """
+    Elimina los bloques <think>...</think> de una respuesta guardada.
+    """
+    if "<think>" not in text:
+        return text
+    return THINK_PATTERN.sub("", text).strip()
+
+
+def build_context(system_message, history, user_message, budget=CONTEXT_TOKEN_BUDGET,
+                  min_recent_turns=CONTEXT_MIN_RECENT_TURNS, count_tokens=None, summary="",
+                  related=()):
+    """
+    Construye los mensajes para /api/chat a partir del historial de la conversación.
+
+    Siempre se incluyen el mensaje del sistema, el mensaje nuevo del usuario y los
+    `min_recent_turns` turnos más recientes. El resto del presupuesto se llena con
+    turnos anteriores, del más reciente al más antiguo, sin dejar huecos.
+    Si se indica `summary` (resumen de los turnos previos a `history`), se envía
+    como un segundo mensaje de sistema. Los turnos `related` (recuperados de otras
+    conversaciones) se envían también como mensaje de sistema, solo si caben en el
+    presupuesto una vez reservado el espacio de lo anterior.
+
+    Retorna una tupla: (mensajes, tokens_enviados).
+    """
+    count = count_tokens or _token_counter
+
+    def message_tokens(content):
+        return count(content) + MESSAGE_OVERHEAD
+
+    used = message_tokens(system_message) + message_tokens(user_message)
+    if summary:
+        summary = SUMMARY_PREFIX + summary
+        used += message_tokens(summary)
+    selected = []
+    for index in range(len(history) - 1, -1, -1):
+        turn = history[index]
+        bot = strip_think(turn["bot"])
+        cost = message_tokens(turn["user"]) + message_tokens(bot)
+        is_recent = len(history) - index <= min_recent_turns
+        if not is_recent and used + cost > budget:
+            break
+        used += cost
+        selected.append((turn["user"], bot))
+
+    related_message = ""
+    if related:
+        related_message = RELATED_PREFIX + "\n\n".join(
+            f"Usuario: {turn['user']}\nAsistente: {strip_think(turn['bot'])}" for turn in related
+        )
+        if used + message_tokens(related_message) <= budget:
+            used += message_tokens(related_message)
+        else:
+            related_message = ""
+
+    messages = [{"role": "system", "content": system_message}]
+    if related_message:
+        messages.append({"role": "system", "content": related_message})
+    if summary:
+        messages.append({"role": "system", "content": summary})
+    for user, bot in reversed(selected):
+        messages.append({"role": "user", "content": user})
+        messages.append({"role": "assistant", "content": bot})
+    messages.append({"role": "user", "content": user_message})
+    return messages, used
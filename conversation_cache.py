@@ -0,0 +1,143 @@
+"""
+Caché de los mensajes de las conversaciones abiertas, compartida por todas las sesiones.
+
+Las sesiones solo guardan los nombres de las carpetas y conversaciones del usuario;
+los mensajes se leen de la base de datos al abrir una conversación y se quedan en
+un LRU acotado en bytes, indexado por el identificador de la conversación. Así la
+memoria de cada sesión no crece con el historial y varias pestañas del mismo
+usuario comparten una sola copia.
+"""
+import threading
+from collections import OrderedDict
+
+from config import CONVERSATION_CACHE_MAX_BYTES
+
+# Bytes aproximados que ocupa un turno además de su texto (dict y objetos str)
+TURN_OVERHEAD = 300
+
+
+def turn_size(turn):
+    return len(turn["user"]) + len(turn["bot"]) + TURN_OVERHEAD
+
+
+class ConversationCache:
+    """
+    LRU de listas de turnos { id_conversación: [ {"user": ..., "bot": ...}, ... ] }.
+    """
+
+    def __init__(self, max_bytes=CONVERSATION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # id -> [turnos, tamaño]
+        self._loads = {}  # id -> [lecturas en curso, cambios durante ellas]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id, load):
+        """
+        Retorna los turnos de la conversación, llamando a `load()` para leerlos si no
+        están en la caché. La lista retornada no se debe modificar (ver append).
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                self._entries.move_to_end(conversation_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        while True:
+            with self._lock:
+                loading = self._loads.setdefault(conversation_id, [0, 0])
+                loading[0] += 1
+                changes = loading[1]
+            # Leer fuera del lock para no bloquear al resto de sesiones
+            try:
+                turns = load()
+            except BaseException:
+                with self._lock:
+                    self._load_finished(conversation_id, loading)
+                raise
+            with self._lock:
+                self._load_finished(conversation_id, loading)
+                entry = self._entries.get(conversation_id)
+                if entry is not None:
+                    return entry[0]  # Otra sesión la cargó mientras tanto
+                # Si otra sesión añadió un turno durante la lectura, puede faltar: releer
+                if loading[1] == changes:
+                    self._insert(conversation_id, turns, sum(turn_size(turn) for turn in turns))
+                    return turns
+
+    def append(self, conversation_id, turn):
+        """
+        Añade un turno a la conversación si está en la caché. Si no lo está, no hace
+        nada: el turno ya está en la base de datos y se leerá al abrirla (las lecturas
+        en curso se repiten, por si se hicieron antes de guardarlo).
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self._mark_changed(conversation_id)
+                return
+            entry[0].append(turn)
+            entry[1] += turn_size(turn)
+            self._bytes += turn_size(turn)
+            self._entries.move_to_end(conversation_id)
+            self._evict()
+
+    def discard(self, conversation_id):
+        with self._lock:
+            self._mark_changed(conversation_id)
+            if conversation_id in self._entries:
+                self._remove(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    # --- Internos (requieren el lock) ------------------------------------
+
+    def _load_finished(self, conversation_id, loading):
+        loading[0] -= 1
+        if not loading[0]:
+            del self._loads[conversation_id]
+
+    def _mark_changed(self, conversation_id):
+        loading = self._loads.get(conversation_id)
+        if loading is not None:
+            loading[1] += 1
+
+    def _insert(self, conversation_id, turns, size):
+        self._entries[conversation_id] = [turns, size]
+        self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        # La conversación usada más recientemente se conserva aunque supere el límite
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, conversation_id):
+        _, size = self._entries.pop(conversation_id)
+        self._bytes -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_conversation_cache():
+    """
+    Retorna la caché de conversaciones compartida por todas las sesiones.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ConversationCache()
+        return _cache
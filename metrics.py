@@ -0,0 +1,258 @@
+"""
+Métricas de latencia y rendimiento de las llamadas al modelo.
+
+Las métricas se acumulan en un registro en memoria del proceso, en histogramas y
+contadores con etiquetas, y se pueden exportar en el formato de texto de Prometheus
+(opcionalmente por HTTP, ver start_metrics_server). Cada llamada también deja una
+línea en el log `chatbot.metrics`.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("chatbot.metrics")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    "chatbot_queue_wait_seconds": ("Tiempo en la cola del planificador", LATENCY_BUCKETS),
+    "chatbot_time_to_first_token_seconds": ("Tiempo hasta el primer token", LATENCY_BUCKETS),
+    "chatbot_time_to_first_visible_token_seconds": (
+        "Tiempo hasta el primer token visible (tras </think>)", LATENCY_BUCKETS
+    ),
+    "chatbot_request_duration_seconds": ("Duración total de la llamada", LATENCY_BUCKETS),
+    "chatbot_tokens_per_second": ("Tokens generados por segundo según Ollama", RATE_BUCKETS),
+    "chatbot_prompt_tokens": ("Tokens del prompt evaluados (prompt_eval_count)", TOKEN_BUCKETS),
+    "chatbot_completion_tokens": ("Tokens generados (eval_count)", TOKEN_BUCKETS),
+}
+COUNTERS = {
+    "chatbot_requests_total": "Llamadas al modelo por resultado",
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """
+    Histograma acumulado con límites de cubetas fijos.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estima el cuantil `q` interpolando dentro de la cubeta que lo contiene.
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= target and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (target - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    Registro de histogramas, contadores y gauges con etiquetas.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (nombre, etiquetas) -> Histogram
+        self._counters = {}    # (nombre, etiquetas) -> valor
+        self._gauges = {}      # nombre -> (ayuda, función que retorna { etiquetas: valor })
+
+    def observe(self, name, value, labels=()):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    def register_gauge(self, name, help_text, collect):
+        """
+        Registra un gauge cuyo valor se calcula al exportar, llamando a `collect()`.
+        """
+        with self._lock:
+            self._gauges[name] = (help_text, collect)
+
+    def summary(self):
+        """
+        Retorna una fila por histograma con su número de observaciones, media, p50 y p95.
+        """
+        with self._lock:
+            return [
+                {
+                    "métrica": name,
+                    "etiquetas": format_labels(labels),
+                    "n": histogram.count,
+                    "media": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+
+    def render_prometheus(self):
+        """
+        Exporta todas las métricas en el formato de texto de Prometheus.
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for name, (help_text, _) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram_name, labels), histogram in histograms:
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    bucket_labels = format_labels(labels + (("le", bound),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        for name, (help_text, collect) in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in collect().items():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class ModelCallMetrics:
+    """
+    Mide una llamada al modelo y la registra al terminar.
+
+    Se crea justo antes de pedir turno en el planificador; `started()` marca la
+    salida de la cola, `token()` y `visible()` el primer token recibido y el primero
+    visible, y `finish()` registra todo junto con los contadores que Ollama envía
+    en su último mensaje (prompt_eval_count, eval_count, eval_duration).
+    """
+
+    def __init__(self, model, mode):
+        self.labels = (("model", model), ("mode", mode))
+        self.created = time.monotonic()
+        self.start = None
+        self.first_token = None
+        self.first_visible = None
+
+    def started(self, queue_wait=None):
+        self.start = time.monotonic()
+        if queue_wait is None:
+            queue_wait = self.start - self.created
+        registry.observe("chatbot_queue_wait_seconds", queue_wait, self.labels)
+
+    def token(self):
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+
+    def visible(self):
+        if self.first_visible is None:
+            self.first_visible = time.monotonic()
+
+    def finish(self, final=None, status="ok"):
+        """
+        Registra la llamada. `final` es el último JSON recibido de Ollama (con done=True).
+        """
+        end = time.monotonic()
+        start = self.start if self.start is not None else self.created
+        registry.inc("chatbot_requests_total", self.labels + (("status", status),))
+        if status != "ok":
+            logger.info("model_call %s status=%s", format_labels(self.labels), status)
+            return
+
+        values = {"chatbot_request_duration_seconds": end - start}
+        if self.first_token is not None:
+            values["chatbot_time_to_first_token_seconds"] = self.first_token - start
+        if self.first_visible is not None:
+            values["chatbot_time_to_first_visible_token_seconds"] = self.first_visible - start
+        final = final or {}
+        if "prompt_eval_count" in final:
+            values["chatbot_prompt_tokens"] = final["prompt_eval_count"]
+        if "eval_count" in final:
+            values["chatbot_completion_tokens"] = final["eval_count"]
+            if final.get("eval_duration"):
+                values["chatbot_tokens_per_second"] = final["eval_count"] / final["eval_duration"] * 1e9
+
+        for name, value in values.items():
+            registry.observe(name, value, self.labels)
+        logger.info(
+            "model_call %s status=ok %s",
+            format_labels(self.labels),
+            " ".join(f"{name.removeprefix('chatbot_')}={value:.3f}" for name, value in values.items()),
+        )
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sin log por cada consulta de Prometheus
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port):
+    """
+    Sirve las métricas en http://<host>:<port>/metrics desde un hilo en segundo plano.
+    Solo se arranca una vez por proceso.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("", port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+        return _server
@@ -0,0 +1,121 @@
+"""
+Cliente HTTP compartido hacia Ollama.
+
+Todas las sesiones de Streamlit del mismo proceso usan una única sesión de
+`requests` por servidor, con conexiones persistentes (keep-alive), timeouts,
+reintentos con backoff ante errores de conexión y un límite de peticiones
+simultáneas.
+"""
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    OLLAMA_URL,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_READ_TIMEOUT,
+    OLLAMA_RETRIES,
+    OLLAMA_RETRY_BACKOFF,
+    OLLAMA_MAX_IN_FLIGHT,
+)
+
+
+class SlotTimeout(requests.exceptions.Timeout):
+    """
+    No ha quedado libre ningún hueco del servidor en el tiempo de espera indicado.
+    """
+
+
+class OllamaClient:
+    """
+    Cliente para un servidor de Ollama con un pool de conexiones propio.
+    """
+
+    def __init__(self, base_url, connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout=OLLAMA_READ_TIMEOUT, retries=OLLAMA_RETRIES,
+                 backoff=OLLAMA_RETRY_BACKOFF, max_in_flight=OLLAMA_MAX_IN_FLIGHT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._in_flight = 0
+        self._count_lock = threading.Lock()
+
+        # Solo se reintentan los errores de conexión: en ese caso la petición
+        # no ha llegado al servidor y repetirla es seguro aunque sea un POST.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=backoff,
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry, pool_connections=1, pool_maxsize=max_in_flight, pool_block=True
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def in_flight(self):
+        """
+        Número de peticiones en curso contra este servidor.
+        """
+        return self._in_flight
+
+    @contextmanager
+    def post(self, path, payload, stream=False, timeout=None, wait=None):
+        """
+        Envía un POST a `path` y entrega la respuesta, esperando antes a que haya
+        un hueco libre si ya hay `max_in_flight` peticiones en curso. Con `wait`,
+        se espera como mucho `wait` segundos y después se lanza SlotTimeout.
+        La respuesta se cierra (y la conexión vuelve al pool) al salir del bloque.
+        """
+        if not self._slots.acquire(timeout=wait):
+            raise SlotTimeout(f"{self.base_url}: sin hueco libre tras {wait} s")
+        try:
+            with self._count_lock:
+                self._in_flight += 1
+            try:
+                response = self.session.post(
+                    self.base_url + path, json=payload, stream=stream, timeout=timeout or self.timeout
+                )
+                try:
+                    response.raise_for_status()
+                    yield response
+                finally:
+                    response.close()
+            finally:
+                with self._count_lock:
+                    self._in_flight -= 1
+        finally:
+            self._slots.release()
+
+    def get(self, path, timeout=None):
+        """
+        Envía un GET a `path` y retorna el JSON de la respuesta.
+        """
+        response = self.session.get(self.base_url + path, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url=OLLAMA_URL):
+    """
+    Retorna el cliente compartido para `base_url`, creándolo la primera vez.
+    """
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = OllamaClient(base_url)
+        return client
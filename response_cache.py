@@ -0,0 +1,190 @@
+"""
+Caché de respuestas del modelo para peticiones repetidas.
+
+La clave es un hash del modelo, las opciones y la lista de mensajes (incluido el
+mensaje del sistema), en la que solo se igualan los saltos de línea y los espacios
+al principio y al final de cada mensaje. Hay dos niveles: un LRU en memoria acotado en
+bytes y una tabla SQLite en disco para que los aciertos sobrevivan a un reinicio,
+acotada al mismo número de bytes. Ambos descartan las entradas más antiguas que el TTL.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+"""
+
+# Bytes que ocupa una entrada en disco (respuesta en UTF-8 y clave), igual que en memoria
+DISK_SIZE = "length(CAST(response AS BLOB)) + length(key)"
+
+# Cada cuántas escrituras se borran del disco las entradas caducadas
+PRUNE_EVERY = 100
+
+
+def is_cacheable(options):
+    """
+    Solo se puede reutilizar una respuesta si el muestreo es determinista.
+    """
+    return options.get("temperature") == 0 or "seed" in options
+
+
+def normalize(text):
+    """
+    Normaliza un mensaje sin cambiar su significado: los espacios interiores y las
+    mayúsculas se conservan (importan en código, siglas o en el historial del asistente).
+    """
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def make_key(model, messages, options):
+    data = {
+        "model": model,
+        "options": options,
+        "messages": [(m["role"], normalize(m["content"])) for m in messages],
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU en memoria acotado en bytes, con TTL y respaldo en disco.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 ttl=RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clave -> (respuesta, tamaño, creada)
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._prune_disk()
+
+    def get(self, key):
+        """
+        Retorna la respuesta guardada para `key`, o None si no hay o ha caducado.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._insert(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._insert(key, response, now)
+            size = len(response.encode("utf-8")) + len(key)
+            if size > self.max_bytes:
+                return
+            old = self._conn.execute(f"SELECT {DISK_SIZE} FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                (key, response, now),
+            )
+            self._disk_bytes += size - (old[0] if old else 0)
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune_disk()
+            elif self._disk_bytes > self.max_bytes:
+                self._evict_disk()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # --- Internos (requieren el lock) ------------------------------------
+
+    def _insert(self, key, response, created):
+        if key in self._entries:
+            self._remove(key)
+        size = len(response.encode("utf-8")) + len(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (response, size, created)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _prune_disk(self):
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        self._disk_bytes = self._conn.execute(f"SELECT COALESCE(SUM({DISK_SIZE}), 0) FROM responses").fetchone()[0]
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """
+        Borra del disco las entradas más antiguas hasta volver a caber en max_bytes.
+        """
+        excess = self._disk_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        keys = []
+        for key, size in self._conn.execute(f"SELECT key, {DISK_SIZE} FROM responses ORDER BY created"):
+            keys.append((key,))
+            excess -= size
+            self._disk_bytes -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Retorna la caché de respuestas compartida por todas las sesiones.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,257 @@
+"""
+Recuperación de turnos relevantes de las conversaciones anteriores del usuario.
+
+Cada turno guardado se convierte en un embedding con el endpoint local de Ollama.
+Los embeddings de un usuario se guardan normalizados en una matriz float32 en disco
+(`<usuario>.f32`), con los identificadores de turno y conversación de cada fila en
+un segundo fichero (`<usuario>.ids`) y la dimensión de los vectores en un tercero
+(`<usuario>.dim`). Los dos primeros solo crecen por el final, y la matriz se lee
+con un memmap, así que buscar es un único producto matriz-vector.
+
+El cálculo de embeddings se hace por lotes en un hilo en segundo plano, fuera del
+camino de la petición; al responder solo se calcula el embedding de la pregunta.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDINGS_DIR,
+    EMBEDDING_BATCH_SIZE,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_KEEP_ALIVE,
+    RAG_TOP_K,
+    RAG_MIN_SCORE,
+    RAG_QUERY_TIMEOUT,
+)
+from backends import get_router
+from context import strip_think
+from scheduler import QueueFull, RequestCancelled, get_scheduler
+
+# Usuario con el que el cálculo de embeddings pide turno en el planificador
+EMBEDDING_USER = "__embeddings__"
+
+# Bytes de una fila del fichero de ids (id de turno e id de conversación, int64)
+IDS_ROW_BYTES = 16
+
+
+def turn_text(user, bot):
+    return f"Usuario: {user}\nAsistente: {strip_think(bot)}"
+
+
+def embed(texts, timeout=None, wait=None):
+    """
+    Calcula los embeddings de una lista de textos en una sola llamada a Ollama.
+    Retorna una matriz float32 con una fila por texto. `timeout` y `wait` limitan
+    la espera de la respuesta y de un hueco libre en el servidor (ver OllamaClient.post).
+    """
+    payload = {"model": EMBEDDING_MODEL, "input": list(texts), "keep_alive": OLLAMA_KEEP_ALIVE}
+    with get_router().client_for(EMBEDDING_MODEL).post("/api/embed", payload, timeout=timeout, wait=wait) as response:
+        data = response.json()
+    return np.asarray(data["embeddings"], dtype=np.float32)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class UserEmbeddingIndex:
+    """
+    Matriz de embeddings de un usuario, ampliable por el final.
+    """
+
+    def __init__(self, directory, username):
+        name = hashlib.sha1(username.encode("utf-8")).hexdigest()
+        self.vectors_path = os.path.join(directory, name + ".f32")
+        self.ids_path = os.path.join(directory, name + ".ids")
+        self.dim_path = os.path.join(directory, name + ".dim")
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._vectors = None
+        self._ids = np.empty((0, 2), dtype=np.int64)
+        self._dim = None
+        self._loaded_size = -1
+
+    def _load(self):
+        """
+        Vuelve a mapear los ficheros si han cambiado desde la última lectura. Las filas
+        que solo están en uno de los dos ficheros (un proceso que terminó entre las dos
+        escrituras de append) se recortan, para que el siguiente lote quede alineado.
+        """
+        size = os.path.getsize(self.ids_path) if os.path.exists(self.ids_path) else 0
+        if size == self._loaded_size:
+            return
+        try:
+            with open(self.dim_path) as f:
+                dim = int(f.read())
+        except (OSError, ValueError):
+            dim = None
+        if dim is None:
+            # Sin la dimensión no se pueden separar las filas: el índice se recalcula
+            self._reset()
+            return
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        rows = min(size // IDS_ROW_BYTES, vectors_size // (4 * dim))
+        for path, length in ((self.ids_path, rows * IDS_ROW_BYTES), (self.vectors_path, rows * 4 * dim)):
+            if os.path.exists(path) and os.path.getsize(path) > length:
+                os.truncate(path, length)
+        self._ids = np.fromfile(self.ids_path, dtype=np.int64).reshape(-1, 2) if rows else self._ids[:0]
+        self._vectors = (
+            np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, dim)) if rows else None
+        )
+        self._dim = dim
+        self._loaded_size = rows * IDS_ROW_BYTES
+
+    def _reset(self):
+        """
+        Borra el índice del disco; los turnos se volverán a indexar desde el principio.
+        """
+        for path in (self.vectors_path, self.ids_path, self.dim_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._clear()
+
+    @property
+    def last_turn_id(self):
+        """
+        Identificador del último turno indexado (0 si no hay ninguno).
+        """
+        with self._lock:
+            self._load()
+            return int(self._ids[-1, 0]) if len(self._ids) else 0
+
+    def append(self, vectors, turn_ids, conversation_ids):
+        """
+        Añade embeddings (se normalizan antes de guardarse) al final de la matriz.
+        Si su dimensión no es la del índice (cambió el modelo de embeddings), el índice
+        se borra y los embeddings no se añaden: se recalcularán todos con el modelo nuevo.
+        """
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        ids = np.column_stack([turn_ids, conversation_ids]).astype(np.int64)
+        with self._lock:
+            self._load()
+            if self._dim is not None and self._dim != vectors.shape[1]:
+                self._reset()
+                return
+            os.makedirs(os.path.dirname(self.vectors_path) or ".", exist_ok=True)
+            if self._dim is None:
+                with open(self.dim_path, "w") as f:
+                    f.write(str(vectors.shape[1]))
+                self._dim = vectors.shape[1]
+            # Primero los vectores: si la escritura se interrumpe antes de los ids, las
+            # filas sobrantes se recortan en la próxima lectura (que se fuerza aquí)
+            self._loaded_size = -1
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(ids.tobytes())
+
+    def search(self, query, k, exclude_conversation=None, min_score=RAG_MIN_SCORE, conversations=None):
+        """
+        Retorna hasta `k` tuplas (id_turno, similitud) con la mayor similitud coseno
+        a `query`, ignorando los turnos de `exclude_conversation` y, si se indica
+        `conversations`, los de las conversaciones que no estén en ella.
+        """
+        with self._lock:
+            self._load()
+            vectors, ids = self._vectors, self._ids
+        if vectors is None or not len(ids) or vectors.shape[1] != len(query):
+            return []
+        query = query / (np.linalg.norm(query) or 1)
+        scores = np.asarray(vectors @ query)
+        if conversations is not None:
+            scores[~np.isin(ids[:, 1], conversations)] = -np.inf
+        if exclude_conversation is not None:
+            scores[ids[:, 1] == exclude_conversation] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i, 0]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+
+class Retriever:
+    """
+    Mantiene los índices de embeddings de los usuarios y los actualiza en segundo plano.
+    """
+
+    def __init__(self, directory=EMBEDDINGS_DIR, batch_size=EMBEDDING_BATCH_SIZE):
+        self.directory = directory
+        self.batch_size = batch_size
+        self._indexes = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embeddings")
+
+    def index_for(self, username):
+        with self._lock:
+            index = self._indexes.get(username)
+            if index is None:
+                index = self._indexes[username] = UserEmbeddingIndex(self.directory, username)
+            return index
+
+    def schedule(self, store, username):
+        """
+        Programa el cálculo de los embeddings de los turnos del usuario aún sin indexar.
+        """
+        with self._lock:
+            if username in self._pending:
+                return
+            self._pending.add(username)
+        self._executor.submit(self._update, store, username)
+
+    def _update(self, store, username):
+        index = self.index_for(username)
+        try:
+            while True:
+                turns = store.turns_after(username, index.last_turn_id, self.batch_size)
+                if not turns:
+                    break
+                with get_scheduler().slot(EMBEDDING_USER, EMBEDDING_MODEL):
+                    vectors = embed(turn_text(user, bot) for _, _, user, bot in turns)
+                index.append(vectors, [t[0] for t in turns], [t[1] for t in turns])
+        except (requests.exceptions.RequestException, QueueFull, RequestCancelled, KeyError):
+            pass  # Se reintentará cuando llegue el siguiente turno
+        finally:
+            with self._lock:
+                self._pending.discard(username)
+
+    def related_turns(self, store, username, text, exclude_conversation=None, k=RAG_TOP_K):
+        """
+        Retorna los turnos de otras conversaciones del usuario más parecidos a `text`.
+        """
+        try:
+            # En el camino de la petición: mejor responder sin contexto que esperar
+            query = embed(
+                [text], timeout=(OLLAMA_CONNECT_TIMEOUT, RAG_QUERY_TIMEOUT), wait=RAG_QUERY_TIMEOUT
+            )[0]
+        except (requests.exceptions.RequestException, KeyError, IndexError):
+            return []
+        # Las filas de conversaciones borradas siguen en la matriz: solo se buscan las vivas
+        conversations = [row[0] for row in store.list_conversation_ids(username)]
+        hits = self.index_for(username).search(query, k, exclude_conversation, conversations=conversations)
+        turns = store.get_turns([turn_id for turn_id, _ in hits])
+        return [turns[turn_id] for turn_id, _ in hits if turn_id in turns]
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever():
+    """
+    Retorna el recuperador compartido por todas las sesiones.
+    """
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None:
+            _retriever = Retriever()
+        return _retriever
@@ -0,0 +1,274 @@
+"""
+Planificador de peticiones al modelo compartido por todas las sesiones.
+
+Cada petición pide turno antes de llamar a Ollama. Los turnos se conceden por
+orden de llegada dentro de cada usuario y en round-robin entre usuarios, con un
+máximo de peticiones simultáneas por modelo y una cola acotada. La llamada en sí
+se hace en el hilo de la sesión, que es el único que puede pintar en Streamlit.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+from config import (
+    SCHEDULER_MAX_CONCURRENCY,
+    SCHEDULER_MAX_QUEUE,
+    SCHEDULER_INITIAL_SERVICE_TIME,
+)
+
+WAITING = "waiting"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+
+# Peso de la última duración observada en la media móvil de duraciones
+SERVICE_TIME_SMOOTHING = 0.3
+
+
+class QueueFull(Exception):
+    """
+    La cola de peticiones está llena.
+    """
+
+
+class RequestCancelled(Exception):
+    """
+    La petición se canceló antes de obtener turno.
+    """
+
+
+class Ticket:
+    """
+    Turno de una petición en el planificador.
+    """
+
+    def __init__(self, scheduler, username, model, session_key):
+        self.scheduler = scheduler
+        self.username = username
+        self.model = model
+        self.session_key = session_key
+        self.state = WAITING
+        self.enqueued = time.monotonic()
+        self.started = None
+
+    @property
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    @property
+    def queue_wait(self):
+        """
+        Segundos que la petición pasó en cola (hasta ahora, si sigue esperando).
+        """
+        return (self.started or time.monotonic()) - self.enqueued
+
+    def position(self):
+        return self.scheduler.position(self)
+
+    def estimated_wait(self):
+        return self.scheduler.estimated_wait(self)
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+
+class RequestScheduler:
+    """
+    Cola justa de peticiones con concurrencia limitada por modelo.
+    """
+
+    def __init__(self, max_concurrency=SCHEDULER_MAX_CONCURRENCY, max_queue=SCHEDULER_MAX_QUEUE,
+                 initial_service_time=SCHEDULER_INITIAL_SERVICE_TIME):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.initial_service_time = initial_service_time
+        self._cond = threading.Condition()
+        # modelo -> { usuario: deque[Ticket] }, en el orden de servicio del round-robin
+        self._queues = defaultdict(OrderedDict)
+        self._active = defaultdict(int)
+        self._service_time = {}
+        self._capacity = {}
+        self._waiting = 0
+        self._by_session = {}
+
+    def submit(self, username, model, session_key=None):
+        """
+        Pone en cola una petición. Si la sesión ya tenía una petición pendiente o en
+        curso, esa petición se cancela. Lanza QueueFull si la cola está llena.
+        """
+        with self._cond:
+            previous = self._by_session.get(session_key) if session_key else None
+            if previous is not None:
+                self._cancel(previous)
+            if self._waiting >= self.max_queue:
+                raise QueueFull(f"Hay {self._waiting} peticiones en cola")
+            ticket = Ticket(self, username, model, session_key)
+            self._queues[model].setdefault(username, deque()).append(ticket)
+            self._waiting += 1
+            if session_key:
+                self._by_session[session_key] = ticket
+            self._dispatch(model)
+            return ticket
+
+    def wait(self, ticket, on_update=None, poll_interval=0.5):
+        """
+        Bloquea hasta que la petición obtiene turno. Mientras espera, llama a
+        `on_update(posición, espera_estimada)` fuera del lock.
+        Lanza RequestCancelled si la petición se cancela antes.
+        """
+        while True:
+            with self._cond:
+                if ticket.state == WAITING:
+                    self._cond.wait(poll_interval)
+                if ticket.state != WAITING:
+                    break
+                position = self._position(ticket)
+                wait = self._estimated_wait(ticket, position)
+            if on_update is not None:
+                on_update(position, wait)
+        if ticket.state == CANCELLED:
+            raise RequestCancelled()
+
+    def release(self, ticket):
+        """
+        Libera el turno de una petición terminada (o la retira de la cola).
+        """
+        with self._cond:
+            if ticket.state == WAITING:
+                self._cancel(ticket)
+            elif ticket.started is not None and ticket.state in (RUNNING, CANCELLED):
+                self._active[ticket.model] -= 1
+                elapsed = time.monotonic() - ticket.started
+                previous = self._service_time.get(ticket.model, self.initial_service_time)
+                self._service_time[ticket.model] = (
+                    SERVICE_TIME_SMOOTHING * elapsed + (1 - SERVICE_TIME_SMOOTHING) * previous
+                )
+                if ticket.state == RUNNING:
+                    ticket.state = DONE
+                self._dispatch(ticket.model)
+            if self._by_session.get(ticket.session_key) is ticket:
+                del self._by_session[ticket.session_key]
+            self._cond.notify_all()
+
+    def cancel(self, ticket):
+        """
+        Cancela una petición. Si está en cola se retira; si está en curso se marca
+        como cancelada para que quien la ejecuta deje de leer la respuesta.
+        """
+        with self._cond:
+            self._cancel(ticket)
+
+    @contextmanager
+    def slot(self, username, model, session_key=None, on_update=None):
+        """
+        Obtiene turno para `model`, lo entrega como Ticket y lo libera al salir.
+        """
+        ticket = self.submit(username, model, session_key)
+        try:
+            self.wait(ticket, on_update)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def set_capacity(self, model, capacity):
+        """
+        Cambia el máximo de peticiones simultáneas a `model`, p. ej. según el número
+        de servidores que lo sirven.
+        """
+        with self._cond:
+            self._capacity[model] = capacity
+            self._dispatch(model)
+
+    def position(self, ticket):
+        with self._cond:
+            return self._position(ticket)
+
+    def estimated_wait(self, ticket):
+        with self._cond:
+            return self._estimated_wait(ticket, self._position(ticket))
+
+    def stats(self):
+        """
+        Retorna { modelo: (en_curso, en_cola) }.
+        """
+        with self._cond:
+            models = set(self._queues) | set(self._active)
+            return {
+                model: (self._active[model], sum(len(q) for q in self._queues[model].values()))
+                for model in models
+            }
+
+    # --- Internos (requieren el lock) ------------------------------------
+
+    def _cancel(self, ticket):
+        if ticket.state == WAITING:
+            user_queue = self._queues[ticket.model].get(ticket.username)
+            if user_queue is not None and ticket in user_queue:
+                user_queue.remove(ticket)
+                if not user_queue:
+                    del self._queues[ticket.model][ticket.username]
+                self._waiting -= 1
+            ticket.state = CANCELLED
+        elif ticket.state == RUNNING:
+            ticket.state = CANCELLED
+        self._cond.notify_all()
+
+    def _dispatch(self, model):
+        queues = self._queues[model]
+        while queues and self._active[model] < self._capacity.get(model, self.max_concurrency):
+            # El usuario al frente del round-robin pasa al final tras ser atendido
+            username, user_queue = next(iter(queues.items()))
+            ticket = user_queue.popleft()
+            if user_queue:
+                queues.move_to_end(username)
+            else:
+                del queues[username]
+            self._waiting -= 1
+            self._active[model] += 1
+            ticket.state = RUNNING
+            ticket.started = time.monotonic()
+        self._cond.notify_all()
+
+    def _position(self, ticket):
+        """
+        Posición (1 = siguiente) de la petición según el orden del round-robin.
+        """
+        if ticket.state != WAITING:
+            return 0
+        queues = self._queues[ticket.model]
+        own_queue = queues.get(ticket.username, ())
+        if ticket not in own_queue:
+            return 0
+        rounds = own_queue.index(ticket)
+        ahead = rounds
+        before_user = True
+        for username, user_queue in queues.items():
+            if username == ticket.username:
+                before_user = False
+                continue
+            # En cada ronda se atiende una petición de cada usuario
+            ahead += min(len(user_queue), rounds + (1 if before_user else 0))
+        return ahead + 1
+
+    def _estimated_wait(self, ticket, position):
+        if position == 0:
+            return 0.0
+        service_time = self._service_time.get(ticket.model, self.initial_service_time)
+        capacity = self._capacity.get(ticket.model, self.max_concurrency)
+        return (position - 1) // capacity * service_time + service_time / 2
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Retorna el planificador compartido por todas las sesiones.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
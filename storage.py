@@ -0,0 +1,717 @@
+"""
+Almacenamiento persistente de conversaciones en SQLite.
+
+Cada mensaje se guarda como una fila nueva en la tabla `turns`, de modo que
+guardar un mensaje cuesta lo mismo sin importar el tamaño del historial.
+Los mensajes de una conversación solo se leen cuando se selecciona.
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+from config import DEFAULT_FOLDER, DEFAULT_CONVERSATION
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    name TEXT NOT NULL,
+    model TEXT,
+    UNIQUE (username, name)
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    folder_id INTEGER NOT NULL REFERENCES folders (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    model TEXT,
+    UNIQUE (folder_id, name)
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+    user TEXT NOT NULL,
+    bot TEXT NOT NULL,
+    created REAL NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id, id);
+CREATE TABLE IF NOT EXISTS summaries (
+    conversation_id INTEGER PRIMARY KEY REFERENCES conversations (id) ON DELETE CASCADE,
+    covered_turns INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Índice de texto completo sobre los turnos, mantenido por triggers en cada inserción
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    user, bot, content='turns', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts (rowid, user, bot) VALUES (new.id, new.user, new.bot);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts (turns_fts, rowid, user, bot) VALUES ('delete', old.id, old.user, old.bot);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_fts_update AFTER UPDATE OF user, bot ON turns BEGIN
+    INSERT INTO turns_fts (turns_fts, rowid, user, bot) VALUES ('delete', old.id, old.user, old.bot);
+    INSERT INTO turns_fts (rowid, user, bot) VALUES (new.id, new.user, new.bot);
+END;
+"""
+
+
+# Máximo de coincidencias (las más recientes) que se ordenan por relevancia en una búsqueda
+SEARCH_MAX_CANDIDATES = 1000
+
+
+# Caracteres de contexto a cada lado de la primera coincidencia en los fragmentos
+SNIPPET_CONTEXT = 60
+
+
+def fold(text):
+    """
+    Pasa a minúsculas y quita los acentos carácter a carácter, conservando la longitud
+    del texto para que las posiciones coincidan con las del original.
+    """
+    folded = []
+    for char in text:
+        base = unicodedata.normalize("NFD", char)[0].lower()
+        folded.append(base if len(base) == 1 else char)
+    return "".join(folded)
+
+
+def make_snippet(text, words):
+    """
+    Fragmento de `text` alrededor de la primera palabra buscada, con las
+    coincidencias en negrita. Retorna "" si ninguna palabra aparece.
+    """
+    folded = fold(text)
+    matches = []
+    for word in words:
+        start = folded.find(word)
+        while start != -1:
+            matches.append((start, start + len(word)))
+            start = folded.find(word, start + len(word))
+    if not matches:
+        return ""
+    matches.sort()
+    begin = max(0, matches[0][0] - SNIPPET_CONTEXT)
+    end = min(len(text), matches[0][1] + SNIPPET_CONTEXT)
+    parts = ["…" if begin > 0 else ""]
+    position = begin
+    for start, stop in matches:
+        if start < position or stop > end:
+            continue
+        parts.append(text[position:start])
+        parts.append(f"**{text[start:stop]}**")
+        position = stop
+    parts.append(text[position:end])
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts)
+
+
+def fts_query(text):
+    """
+    Convierte el texto de búsqueda en una consulta FTS5: todas las palabras deben
+    aparecer, y la última puede estar incompleta (búsqueda mientras se escribe).
+    """
+    words = text.split()
+    if not words:
+        return ""
+    terms = ['"%s"' % word.replace('"', '""') for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+class ConversationStore:
+    """
+    Acceso a la base de datos de conversaciones.
+
+    Una misma instancia se comparte entre todas las sesiones del servidor,
+    por lo que cada operación se serializa con un lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._add_turn_positions()
+        self._add_models()
+        has_index = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'turns_fts'"
+        ).fetchone()
+        self._conn.executescript(SEARCH_SCHEMA)
+        if not has_index:
+            # Base de datos anterior al índice: indexar los turnos existentes una vez
+            self._conn.execute("INSERT INTO turns_fts (turns_fts) VALUES ('rebuild')")
+
+    def _add_turn_positions(self):
+        """
+        Añade la posición de cada turno dentro de su conversación a las bases de
+        datos creadas antes de que existiera la columna.
+        """
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(turns)")]
+        if "position" in columns:
+            return
+        self._conn.execute("ALTER TABLE turns ADD COLUMN position INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "UPDATE turns SET position = numbered.position FROM ("
+            "  SELECT id, ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY id) - 1 AS position "
+            "  FROM turns"
+            ") AS numbered WHERE numbered.id = turns.id"
+        )
+
+    def _add_models(self):
+        """
+        Añade el modelo elegido por carpeta y por conversación a las bases de datos
+        creadas antes de que existieran las columnas.
+        """
+        for table in ("folders", "conversations"):
+            columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+            if "model" not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN model TEXT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- Carpetas -------------------------------------------------------
+
+    def _folder_id(self, username, folder):
+        row = self._conn.execute(
+            "SELECT id FROM folders WHERE username = ? AND name = ?", (username, folder)
+        ).fetchone()
+        return row[0] if row else None
+
+    def ensure_user(self, username):
+        """
+        Garantiza que el usuario tiene la carpeta y la conversación por defecto.
+        """
+        with self._lock:
+            self.create_folder(username, DEFAULT_FOLDER)
+
+    def list_folders(self, username):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name FROM folders WHERE username = ? ORDER BY id", (username,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def create_folder(self, username, folder):
+        """
+        Crea una carpeta con su conversación inicial.
+        Retorna True si se crea la carpeta, o False si ya existía.
+        """
+        with self._lock:
+            if self._folder_id(username, folder) is not None:
+                return False
+            cursor = self._conn.execute(
+                "INSERT INTO folders (username, name) VALUES (?, ?)", (username, folder)
+            )
+            self._conn.execute(
+                "INSERT INTO conversations (folder_id, name) VALUES (?, ?)",
+                (cursor.lastrowid, DEFAULT_CONVERSATION),
+            )
+            return True
+
+    def rename_folder(self, username, old_name, new_name):
+        """
+        Renombra una carpeta. Retorna False si el nombre nuevo ya existe.
+        """
+        with self._lock:
+            if self._folder_id(username, new_name) is not None:
+                return False
+            self._conn.execute(
+                "UPDATE folders SET name = ? WHERE username = ? AND name = ?",
+                (new_name, username, old_name),
+            )
+            return True
+
+    # --- Conversaciones -------------------------------------------------
+
+    def _conversation_id(self, username, folder, conversation):
+        row = self._conn.execute(
+            "SELECT c.id FROM conversations c JOIN folders f ON f.id = c.folder_id "
+            "WHERE f.username = ? AND f.name = ? AND c.name = ?",
+            (username, folder, conversation),
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_conversation_id(self, username, folder, conversation):
+        """
+        Retorna el identificador interno de la conversación, o None si no existe.
+        Se mantiene aunque la conversación o su carpeta se renombren.
+        """
+        with self._lock:
+            return self._conversation_id(username, folder, conversation)
+
+    def list_conversations(self, username, folder):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.name FROM conversations c JOIN folders f ON f.id = c.folder_id "
+                "WHERE f.username = ? AND f.name = ? ORDER BY c.id",
+                (username, folder),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_tree(self, username):
+        """
+        Retorna la estructura { carpeta: [conversación, ...] } del usuario, sin mensajes.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT f.name, c.name FROM folders f "
+                "LEFT JOIN conversations c ON c.folder_id = f.id "
+                "WHERE f.username = ? ORDER BY f.id, c.id",
+                (username,),
+            ).fetchall()
+        tree = {}
+        for folder, conversation in rows:
+            conversations = tree.setdefault(folder, [])
+            if conversation is not None:
+                conversations.append(conversation)
+        return tree
+
+    def create_conversation(self, username, folder, conversation):
+        """
+        Crea una conversación vacía. Retorna False si ya existía.
+        """
+        with self._lock:
+            if self._conversation_id(username, folder, conversation) is not None:
+                return False
+            folder_id = self._folder_id(username, folder)
+            if folder_id is None:
+                self.create_folder(username, folder)
+                folder_id = self._folder_id(username, folder)
+                if conversation == DEFAULT_CONVERSATION:
+                    return True
+            self._conn.execute(
+                "INSERT INTO conversations (folder_id, name) VALUES (?, ?)",
+                (folder_id, conversation),
+            )
+            return True
+
+    def rename_conversation(self, username, folder, old_name, new_name):
+        """
+        Renombra una conversación. Retorna False si el nombre nuevo ya existe.
+        """
+        with self._lock:
+            if self._conversation_id(username, folder, new_name) is not None:
+                return False
+            conversation_id = self._conversation_id(username, folder, old_name)
+            self._conn.execute(
+                "UPDATE conversations SET name = ? WHERE id = ?", (new_name, conversation_id)
+            )
+            return True
+
+    # --- Modelos --------------------------------------------------------
+
+    def get_models(self, username, folder, conversation):
+        """
+        Retorna (modelo de la carpeta, modelo de la conversación); None si no se eligió.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT f.model, c.model FROM folders f "
+                "LEFT JOIN conversations c ON c.folder_id = f.id AND c.name = ? "
+                "WHERE f.username = ? AND f.name = ?",
+                (conversation, username, folder),
+            ).fetchone()
+        return row if row else (None, None)
+
+    def set_folder_model(self, username, folder, model):
+        """
+        Elige el modelo de las conversaciones de la carpeta (None = el modelo por defecto).
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE folders SET model = ? WHERE username = ? AND name = ?", (model, username, folder)
+            )
+
+    def set_conversation_model(self, username, folder, conversation, model):
+        """
+        Elige el modelo de la conversación (None = el de su carpeta).
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE conversations SET model = ? WHERE id = ?",
+                (model, self._conversation_id(username, folder, conversation)),
+            )
+
+    # --- Mensajes -------------------------------------------------------
+
+    def load_turns(self, username, folder, conversation):
+        """
+        Lee todos los mensajes de una conversación en orden.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT t.user, t.bot FROM turns t "
+                "JOIN conversations c ON c.id = t.conversation_id "
+                "JOIN folders f ON f.id = c.folder_id "
+                "WHERE f.username = ? AND f.name = ? AND c.name = ? ORDER BY t.id",
+                (username, folder, conversation),
+            ).fetchall()
+        return [{"user": user, "bot": bot} for user, bot in rows]
+
+    def _next_position(self, conversation_id):
+        row = self._conn.execute(
+            "SELECT position FROM turns WHERE conversation_id = ? ORDER BY id DESC LIMIT 1",
+            (conversation_id,),
+        ).fetchone()
+        return row[0] + 1 if row else 0
+
+    def append_turn(self, username, folder, conversation, user, bot):
+        """
+        Añade un mensaje al final de la conversación (la crea si no existe).
+        """
+        with self._lock:
+            conversation_id = self._conversation_id(username, folder, conversation)
+            if conversation_id is None:
+                self.create_conversation(username, folder, conversation)
+                conversation_id = self._conversation_id(username, folder, conversation)
+            self._conn.execute(
+                "INSERT INTO turns (conversation_id, user, bot, created, position) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, user, bot, time.time(), self._next_position(conversation_id)),
+            )
+
+    def turns_after(self, username, turn_id, limit):
+        """
+        Retorna hasta `limit` turnos del usuario con identificador mayor que `turn_id`,
+        como tuplas (id, id_conversación, user, bot) en orden de inserción.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT t.id, t.conversation_id, t.user, t.bot FROM turns t "
+                "JOIN conversations c ON c.id = t.conversation_id "
+                "JOIN folders f ON f.id = c.folder_id "
+                "WHERE f.username = ? AND t.id > ? ORDER BY t.id LIMIT ?",
+                (username, turn_id, limit),
+            ).fetchall()
+
+    def get_turns(self, turn_ids):
+        """
+        Retorna { id: {"user": ..., "bot": ...} } para los turnos indicados.
+        """
+        if not turn_ids:
+            return {}
+        placeholders = ",".join("?" * len(turn_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, user, bot FROM turns WHERE id IN ({placeholders})", list(turn_ids)
+            ).fetchall()
+        return {turn_id: {"user": user, "bot": bot} for turn_id, user, bot in rows}
+
+    # --- Búsqueda -------------------------------------------------------
+
+    def search(self, username, text, limit=20):
+        """
+        Busca en todos los turnos del usuario. Retorna los resultados por relevancia,
+        cada uno con su carpeta, conversación, posición del turno (desde 0) y un
+        fragmento del texto con las coincidencias resaltadas.
+
+        Si la búsqueda coincide con más de SEARCH_MAX_CANDIDATES turnos, solo se
+        ordenan por relevancia los más recientes, para acotar el tiempo de respuesta.
+        """
+        query = fts_query(text)
+        if not query:
+            return []
+        with self._lock:
+            ranked = self._conn.execute(
+                "SELECT id FROM ("
+                "  SELECT turns_fts.rowid AS id, bm25(turns_fts) AS score FROM turns_fts "
+                "  JOIN turns t ON t.id = turns_fts.rowid "
+                "  JOIN conversations c ON c.id = t.conversation_id "
+                "  JOIN folders f ON f.id = c.folder_id "
+                "  WHERE turns_fts MATCH ? AND f.username = ? "
+                "  ORDER BY turns_fts.rowid DESC LIMIT ?"
+                ") ORDER BY score LIMIT ?",
+                (query, username, SEARCH_MAX_CANDIDATES, limit),
+            ).fetchall()
+            ids = [row[0] for row in ranked]
+            if not ids:
+                return []
+            placeholders = ",".join("?" * len(ids))
+            rows = self._conn.execute(
+                "SELECT t.id, f.name, c.name, t.position, t.user, t.bot "
+                "FROM turns t "
+                "JOIN conversations c ON c.id = t.conversation_id "
+                "JOIN folders f ON f.id = c.folder_id "
+                f"WHERE t.id IN ({placeholders})",
+                ids,
+            ).fetchall()
+        details = {row[0]: row[1:] for row in rows}
+        words = [fold(word) for word in text.split()]
+        results = []
+        for turn_id in ids:
+            folder, conversation, position, user, bot = details[turn_id]
+            results.append({
+                "folder": folder,
+                "conversation": conversation,
+                "position": position,
+                "snippet": make_snippet(user, words) or make_snippet(bot, words),
+            })
+        return results
+
+    # --- Resúmenes -----------------------------------------------------
+
+    def get_summary(self, conversation_id):
+        """
+        Retorna (texto, turnos_resumidos) del resumen de la conversación,
+        o ("", 0) si aún no tiene resumen.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, covered_turns FROM summaries WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def save_summary(self, conversation_id, text, covered_turns):
+        """
+        Guarda el resumen de los primeros `covered_turns` turnos de la conversación.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (conversation_id, covered_turns, text, updated) "
+                "VALUES (?, ?, ?, ?)",
+                (conversation_id, covered_turns, text, time.time()),
+            )
+
+    # --- Operaciones en bloque ------------------------------------------
+
+    def _ensure_folder(self, username, folder):
+        """
+        Retorna el id de la carpeta, creándola vacía (sin conversación inicial) si no existe.
+        """
+        folder_id = self._folder_id(username, folder)
+        if folder_id is None:
+            folder_id = self._conn.execute(
+                "INSERT INTO folders (username, name) VALUES (?, ?)", (username, folder)
+            ).lastrowid
+        return folder_id
+
+    def _ensure_conversation(self, folder_id):
+        """
+        Crea la conversación inicial de la carpeta si se ha quedado sin conversaciones,
+        para que la conversación actual por defecto exista en la base de datos y en el árbol.
+        """
+        if self._conn.execute("SELECT 1 FROM conversations WHERE folder_id = ? LIMIT 1", (folder_id,)).fetchone():
+            return
+        self._conn.execute(
+            "INSERT INTO conversations (folder_id, name) VALUES (?, ?)", (folder_id, DEFAULT_CONVERSATION)
+        )
+
+    def _bulk(self, operation):
+        """
+        Ejecuta `operation()` en una sola transacción y retorna su resultado.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                result = operation()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def move_conversations(self, username, folder, conversations, target_folder):
+        """
+        Mueve varias conversaciones de `folder` a `target_folder` (se crea si no existe).
+        Las que ya existen con el mismo nombre en el destino no se mueven, y la carpeta
+        que se quede vacía recupera su conversación inicial.
+        Retorna la lista de conversaciones movidas.
+        """
+        def move():
+            target_id = self._ensure_folder(username, target_folder)
+            moved = []
+            for conversation in conversations:
+                conversation_id = self._conversation_id(username, folder, conversation)
+                if conversation_id is None or self._conversation_id(username, target_folder, conversation):
+                    continue
+                self._conn.execute(
+                    "UPDATE conversations SET folder_id = ? WHERE id = ?", (target_id, conversation_id)
+                )
+                moved.append(conversation)
+            for folder_id in {self._folder_id(username, folder), target_id} - {None}:
+                self._ensure_conversation(folder_id)
+            return moved
+        return self._bulk(move)
+
+    def rename_conversations(self, username, folder, renames):
+        """
+        Renombra varias conversaciones de la carpeta a la vez ({ nombre: nombre_nuevo }).
+        Se omiten las que chocarían con otra conversación. Retorna { nombre: nombre_nuevo }
+        de las renombradas.
+        """
+        def rename():
+            ids = {old: self._conversation_id(username, folder, old) for old in renames}
+            renamed = {old: new for old, new in renames.items() if ids[old] is not None}
+            # Descartar hasta que no queden choques: con las que no se renombran
+            # (incluidas las descartadas) o entre dos nombres nuevos iguales
+            while True:
+                names = set(self.list_conversations(username, folder)) - set(renamed)
+                targets = list(renamed.values())
+                clashes = {old for old, new in renamed.items() if new in names or targets.count(new) > 1}
+                if not clashes:
+                    break
+                for old in clashes:
+                    del renamed[old]
+            # Nombre temporal primero, para permitir intercambios (a -> b, b -> a)
+            for old in renamed:
+                self._conn.execute(
+                    "UPDATE conversations SET name = ? WHERE id = ?", (f"\\0{ids[old]}", ids[old])
+                )
+            for old, new in renamed.items():
+                self._conn.execute("UPDATE conversations SET name = ? WHERE id = ?", (new, ids[old]))
+            return renamed
+        return self._bulk(rename)
+
+    def delete_conversations(self, username, folder, conversations):
+        """
+        Borra varias conversaciones con sus mensajes. Si la carpeta se queda vacía, se
+        vuelve a crear su conversación inicial. Retorna los identificadores borrados.
+        """
+        def delete():
+            ids = [self._conversation_id(username, folder, c) for c in conversations]
+            ids = [conversation_id for conversation_id in ids if conversation_id is not None]
+            self._conn.executemany("DELETE FROM conversations WHERE id = ?", [(i,) for i in ids])
+            folder_id = self._folder_id(username, folder)
+            if folder_id is not None:
+                self._ensure_conversation(folder_id)
+            return ids
+        return self._bulk(delete)
+
+    def delete_folder(self, username, folder):
+        """
+        Borra una carpeta con todas sus conversaciones. Retorna los identificadores
+        de las conversaciones borradas.
+        """
+        def delete():
+            folder_id = self._folder_id(username, folder)
+            if folder_id is None:
+                return []
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM conversations WHERE folder_id = ?", (folder_id,)
+            )]
+            self._conn.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+            return ids
+        return self._bulk(delete)
+
+    # --- Archivos -------------------------------------------------------
+
+    def list_conversation_ids(self, username=None, folders=None):
+        """
+        Retorna [(id, usuario, carpeta, conversación), ...] de las conversaciones del
+        usuario (de todos si `username` es None), opcionalmente solo de `folders`.
+        """
+        query = (
+            "SELECT c.id, f.username, f.name, c.name FROM conversations c "
+            "JOIN folders f ON f.id = c.folder_id"
+        )
+        conditions, params = [], []
+        if username is not None:
+            conditions.append("f.username = ?")
+            params.append(username)
+        if folders:
+            conditions.append(f"f.name IN ({','.join('?' * len(folders))})")
+            params.extend(folders)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY f.username, f.id, c.id", params).fetchall()
+
+    def conversation_turns(self, conversation_id):
+        """
+        Retorna [(user, bot, created), ...] de la conversación en orden.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT user, bot, created FROM turns WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,),
+            ).fetchall()
+
+    def import_conversation(self, username, folder, conversation, turns, conversation_id=None):
+        """
+        Añade turnos (user, bot, created) en una sola transacción. Sin `conversation_id`
+        se crea una conversación nueva; si el nombre ya existe en la carpeta se le añade
+        " (importada N)". Retorna el identificador de la conversación.
+        """
+        def insert():
+            nonlocal conversation_id
+            if conversation_id is None:
+                folder_id = self._ensure_folder(username, folder)
+                name, n = conversation, 1
+                while self._conversation_id(username, folder, name) is not None:
+                    name = f"{conversation} (importada {n})" if n > 1 else f"{conversation} (importada)"
+                    n += 1
+                conversation_id = self._conn.execute(
+                    "INSERT INTO conversations (folder_id, name) VALUES (?, ?)", (folder_id, name)
+                ).lastrowid
+            first = self._next_position(conversation_id)
+            self._conn.executemany(
+                "INSERT INTO turns (conversation_id, user, bot, created, position) VALUES (?, ?, ?, ?, ?)",
+                [(conversation_id, user, bot, created, first + i) for i, (user, bot, created) in enumerate(turns)],
+            )
+            return conversation_id
+        return self._bulk(insert)
+
+    # --- Migración ------------------------------------------------------
+
+    def import_tree(self, conversations):
+        """
+        Importa el formato antiguo { usuario: { carpeta: { conversación: [turnos] } } },
+        tal y como se guardaba en `conversations_json`. Las carpetas guardadas como
+        lista se tratan como una única "Conversación 1".
+        Retorna el número de mensajes importados.
+        """
+        imported = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for username, folders in conversations.items():
+                    for folder, folder_conversations in folders.items():
+                        if isinstance(folder_conversations, list):
+                            folder_conversations = {DEFAULT_CONVERSATION: folder_conversations}
+                        self.create_folder(username, folder)
+                        for conversation, turns in folder_conversations.items():
+                            self.create_conversation(username, folder, conversation)
+                            conversation_id = self._conversation_id(username, folder, conversation)
+                            now = time.time()
+                            first = self._next_position(conversation_id)
+                            self._conn.executemany(
+                                "INSERT INTO turns (conversation_id, user, bot, created, position) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                [(conversation_id, t["user"], t["bot"], now, first + i)
+                                 for i, t in enumerate(turns)],
+                            )
+                            imported += len(turns)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return imported
+
+
+if __name__ == "__main__":
+    # Migración desde un volcado de `conversations_json`:
+    #   python storage.py conversations.json
+    from config import DB_PATH
+
+    if len(sys.argv) != 2:
+        sys.exit("Uso: python storage.py <conversations.json>")
+    with open(sys.argv[1], encoding="utf-8") as f:
+        data = json.load(f)
+    store = ConversationStore(DB_PATH)
+    count = store.import_tree(data)
+    store.close()
+    print(f"Importados {count} mensajes en {DB_PATH}")
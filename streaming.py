@@ -0,0 +1,133 @@
+"""
+Utilidades para procesar y mostrar en la interfaz respuestas que llegan en streaming.
+"""
+import time
+
+from config import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS
+
+
+class StreamRenderer:
+    """
+    Acumula los fragmentos de texto recibidos y actualiza un placeholder de
+    Streamlit por lotes, en lugar de repintarlo con cada token.
+
+    El primer fragmento se pinta de inmediato; los siguientes se agrupan hasta
+    que pasan `interval` segundos o se acumulan `max_chars` caracteres.
+    """
+
+    def __init__(self, placeholder, interval=STREAM_FLUSH_INTERVAL, max_chars=STREAM_FLUSH_CHARS):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.max_chars = max_chars
+        self._text = ""
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = 0.0
+
+    @property
+    def text(self):
+        """
+        Texto completo recibido hasta ahora (pintado o pendiente).
+        """
+        self._merge_pending()
+        return self._text
+
+    def write(self, chunk):
+        """
+        Añade un fragmento y repinta si se ha agotado el tiempo o el tamaño del lote.
+        """
+        if not chunk:
+            return
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        if (self._pending_chars >= self.max_chars
+                or time.monotonic() - self._last_flush >= self.interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Pinta en el placeholder todo lo pendiente.
+        """
+        if self._pending:
+            self._merge_pending()
+            self.placeholder.text(self._text)
+        self._last_flush = time.monotonic()
+
+    def _merge_pending(self):
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending = []
+            self._pending_chars = 0
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_length(text, tag):
+    """
+    Longitud del sufijo más largo de `text` que es un prefijo (incompleto) de `tag`.
+    """
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ThinkParser:
+    """
+    Separa el razonamiento (<think>...</think>) del texto visible de una respuesta
+    que llega por fragmentos.
+
+    Las etiquetas pueden llegar partidas entre fragmentos (`<thi` + `nk>`): el final
+    de un fragmento que podría ser el comienzo de una etiqueta se retiene hasta el
+    siguiente. Cada fragmento se procesa una sola vez, sin volver sobre el texto anterior.
+    """
+
+    def __init__(self):
+        self.in_think = False
+        self._carry = ""
+
+    def feed(self, chunk):
+        """
+        Procesa un fragmento. Retorna una tupla: (texto_visible, texto_razonamiento).
+        """
+        text = self._carry + chunk
+        self._carry = ""
+        visible = []
+        reasoning = []
+        position = 0
+        while True:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            index = text.find(tag, position)
+            if index == -1:
+                break
+            (reasoning if self.in_think else visible).append(text[position:index])
+            position = index + len(tag)
+            self.in_think = not self.in_think
+
+        rest = text[position:]
+        partial = _partial_tag_length(rest, THINK_CLOSE if self.in_think else THINK_OPEN)
+        if partial:
+            self._carry = rest[-partial:]
+            rest = rest[:-partial]
+        (reasoning if self.in_think else visible).append(rest)
+        return "".join(visible), "".join(reasoning)
+
+    def close(self):
+        """
+        Vacía el texto retenido al terminar la respuesta (no era una etiqueta).
+        Retorna una tupla: (texto_visible, texto_razonamiento).
+        """
+        carry, self._carry = self._carry, ""
+        return ("", carry) if self.in_think else (carry, "")
+
+
+def split_think(text):
+    """
+    Separa una respuesta completa en (texto_visible, texto_razonamiento).
+    """
+    parser = ThinkParser()
+    visible, reasoning = parser.feed(text)
+    tail_visible, tail_reasoning = parser.close()
+    return (visible + tail_visible).strip(), (reasoning + tail_reasoning).strip()
@@ -0,0 +1,155 @@
+"""
+Resumen incremental de los turnos antiguos de una conversación.
+
+Cuando una conversación crece, los turnos que quedan fuera de la ventana
+reciente se condensan en un resumen que se guarda junto a la conversación y
+se envía al modelo en lugar de esos turnos. El resumen se genera en segundo
+plano, fuera del camino de la petición, y solo se regenera cuando salen de la
+ventana suficientes turnos nuevos. Si son muchos (p. ej. el primer resumen de una
+conversación larga), se resumen por bloques que caben en CONTEXT_TOKEN_BUDGET.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import context
+from config import (
+    CONTEXT_TOKEN_BUDGET,
+    MODEL_NAME,
+    MODEL_OPTIONS,
+    OLLAMA_KEEP_ALIVE,
+    SUMMARY_KEEP_TURNS,
+    SUMMARY_MIN_NEW_TURNS,
+)
+from backends import get_router
+from context import MESSAGE_OVERHEAD, strip_think
+from scheduler import QueueFull, RequestCancelled, get_scheduler
+
+# Usuario con el que los resúmenes piden turno en el planificador
+SUMMARY_USER = "__resumen__"
+
+SUMMARY_INSTRUCTIONS = (
+    "Resume de forma breve y en español la siguiente conversación entre un usuario "
+    "y un asistente. Conserva los datos, nombres, decisiones y preguntas pendientes "
+    "que puedan ser útiles para continuarla. Responde solo con el resumen."
+)
+
+
+def format_turn(turn):
+    return f"Usuario: {turn['user']}\nAsistente: {strip_think(turn['bot'])}"
+
+
+def format_turns(turns):
+    return "\n".join(format_turn(turn) for turn in turns)
+
+
+def chunk_size(previous_summary, turns, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Retorna cuántos de los primeros `turns` caben en `budget` tokens junto con las
+    instrucciones y el resumen previo (al menos uno, aunque no quepa).
+    """
+    count = context._token_counter
+    used = count(SUMMARY_INSTRUCTIONS) + count(previous_summary) + 2 * MESSAGE_OVERHEAD
+    size = 0
+    for turn in turns:
+        used += count(format_turn(turn)) + 1
+        if size and used > budget:
+            break
+        size += 1
+    return size
+
+
+class Summarizer:
+    """
+    Genera y actualiza resúmenes en un hilo en segundo plano.
+    """
+
+    def __init__(self, keep_turns=SUMMARY_KEEP_TURNS, min_new_turns=SUMMARY_MIN_NEW_TURNS):
+        self.keep_turns = keep_turns
+        self.min_new_turns = min_new_turns
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def split(self, store, conversation_id, turns):
+        """
+        Retorna (resumen, turnos_sin_resumir) para construir el contexto:
+        los turnos ya cubiertos por el resumen guardado se sustituyen por él.
+        """
+        summary, covered = store.get_summary(conversation_id)
+        return summary, turns[covered:]
+
+    def schedule(self, store, conversation_id, turns, model=MODEL_NAME):
+        """
+        Programa la actualización del resumen si han salido de la ventana
+        reciente al menos `min_new_turns` turnos desde el último resumen.
+        El resumen lo genera `model`, el de la conversación, para no cargar otro.
+        """
+        cutoff = len(turns) - self.keep_turns
+        summary, covered = store.get_summary(conversation_id)
+        if cutoff - covered < self.min_new_turns:
+            return
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+        new_turns = list(turns[covered:cutoff])
+        self._executor.submit(self._update, store, conversation_id, summary, covered, new_turns, model)
+
+    def _update(self, store, conversation_id, summary, covered, new_turns, model):
+        try:
+            start = 0
+            while start < len(new_turns):
+                size = chunk_size(summary, new_turns[start:])
+                # Se pide turno para cada bloque, para no acaparar el modelo
+                with get_scheduler().slot(SUMMARY_USER, model):
+                    text = summarize(summary, new_turns[start:start + size], model)
+                if not text:
+                    break
+                summary, start = text, start + size
+                # Guardar tras cada bloque: si se interrumpe, se continúa desde aquí
+                store.save_summary(conversation_id, summary, covered + start)
+        except (requests.exceptions.RequestException, QueueFull, RequestCancelled):
+            pass  # Se reintentará cuando llegue el siguiente turno
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+
+def summarize(previous_summary, turns, model=MODEL_NAME):
+    """
+    Pide al modelo un resumen que combine el resumen anterior con los turnos nuevos.
+    """
+    content = format_turns(turns)
+    if previous_summary:
+        content = f"Resumen previo:\n{previous_summary}\n\nContinuación:\n{content}"
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": content},
+        ],
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+    if MODEL_OPTIONS:
+        payload["options"] = MODEL_OPTIONS
+    with get_router().client_for(model).post("/api/chat", payload) as response:
+        data = response.json()
+    return strip_think(data.get("message", {}).get("content", "")).strip()
+
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+
+def get_summarizer():
+    """
+    Retorna el generador de resúmenes compartido por todas las sesiones.
+    """
+    global _summarizer
+    with _summarizer_lock:
+        if _summarizer is None:
+            _summarizer = Summarizer()
+        return _summarizer